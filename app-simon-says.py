@@ -2,10 +2,12 @@ import asyncio
 from functools import partial
 import logging
 import os
+from typing import Callable, List, Tuple, Union
 
 import gradio as gr
 
 import simon
+from simon.gemini import tool_outputs
 
 log = logging.getLogger('simon-says')
 log.setLevel(logging.INFO)
@@ -186,27 +188,50 @@ TOOLS = {
     "salute": salute,
     "nod_yes": nod_yes,
 }
+c['gemini'].register_tools(TOOLS)
+
+IMAGE_PROMPT = "if there is a human in the image, what pose are they in? what are the left arm and right arm doing? which way is the head facing?"
+AUDIO_PROMPT = "based on this audio clip, how should we raise or lower our left arm and right arm? what direction should we turn our head? should we change our eye color or blink a specific eye? this audio may be in english, espanol, or francais."
+VIDEO_PROMPT = "what are the people in this video doing? how should we move our arms and head to mimic them?"
+FUSED_PROMPT = "the image shows the person in front of us and the audio clip is what they said, it may be in english, espanol, or francais. use both to decide how we should move our arms and head, and whether to change our eye color or blink a specific eye."
+
+async def simon_says_from_media(media_path: Union[str, List[str]], prompt: str, process: Callable = None) -> str:
+    # one request with media and tools, or describe-then-act with process when perceive_and_act is off
+    if c['gemini'].config.perceive_and_act or process is None:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(c['audio'].async_play_audio('thinking', multilingual=True, priority=1))
+            result = tg.create_task(c['gemini'].async_perceive_and_act(TOOLS, media_path, prompt))
+        return tool_outputs(result.result())
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(c['audio'].async_play_audio('thinking', multilingual=True, priority=1))
+            result = tg.create_task(process(media_path, prompt))
+    except* Exception as e:
+        error = e
+    else:
+        log.debug(f"{process.__name__}.result(): {result.result()}")
+        return tool_outputs(await c['gemini'].async_use_tool(TOOLS, result.result()))
+    return tool_outputs(await c['gemini'].async_fallback(TOOLS, error))
 
 async def simon_says_from_image(image_path: str) -> str:
-    async with asyncio.TaskGroup() as tg:
-        tg.create_task(c['audio'].async_play_audio('think', multilingual=True))
-        result = tg.create_task(c['gemini'].async_process_image(image_path, "if there is a human in the image, what pose are they in? what are the left arm and right arm doing? which way is the head facing?"))
-    log.debug(f"image.result(): {result.result()}")
-    return await c['gemini'].async_use_tool(TOOLS, result.result())
+    c['gemini'].begin_turn()
+    return await simon_says_from_media(image_path, IMAGE_PROMPT, c['gemini'].async_process_image)
 
 async def simon_says_from_audio(audio_path: str) -> str:
-    async with asyncio.TaskGroup() as tg:
-        tg.create_task(c['audio'].async_play_audio('think', multilingual=True))
-        result = tg.create_task(c['gemini'].async_process_audio(audio_path, "based on this audio clip, how should we raise or lower our left arm and right arm? what direction should we turn our head? should we change our eye color or blink a specific eye? this audio may be in english, espanol, or francais."))
-    log.debug(f"audio.result(): {result.result()}")
-    return await c['gemini'].async_use_tool(TOOLS, result.result())
+    c['gemini'].begin_turn()
+    return await simon_says_from_media(audio_path, AUDIO_PROMPT, c['gemini'].async_process_audio)
 
 async def simon_says_from_video(video_path: str) -> str:
+    c['gemini'].begin_turn()
+    return await simon_says_from_media(video_path, VIDEO_PROMPT, c['gemini'].async_process_video)
+
+async def simon_says_from_image_and_audio(image_path: str, audio_path: str, duration: float) -> Tuple[str, str, str]:
+    # capture a still and the spoken command at the same time, both go out in one request
+    c['gemini'].begin_turn()
     async with asyncio.TaskGroup() as tg:
-        tg.create_task(c['audio'].async_play_audio('think', multilingual=True))
-        result = tg.create_task(c['gemini'].async_process_video(video_path, "what are the people in this video doing? how should we move our arms and head to mimic them?"))
-    log.debug(f"video.result(): {result.result()}")
-    return await c['gemini'].async_use_tool(TOOLS, result.result())
+        image = tg.create_task(c['camera'].async_use_camera(image_path))
+        audio = tg.create_task(c['audio'].async_record_audio(audio_path, duration))
+    return image.result(), audio.result(), await simon_says_from_media([image.result(), audio.result()], FUSED_PROMPT)
 
 with gr.Blocks(theme=c['theme']) as demo:
     with gr.Row():
@@ -214,7 +239,7 @@ with gr.Blocks(theme=c['theme']) as demo:
             with gr.Row():
                 image_path = os.path.join(simon.IMAGE_DIR, f'test_gemini.{c["camera"].config.image_filetype}')
                 video_path = os.path.join(simon.IMAGE_DIR, f'test_gemini.{c["camera"].config.video_filetype}')
-                audio_path = os.path.join(simon.AUDIO_DIR, f'test_gemini.{c["audio"].config.filetype}')
+                audio_path = os.path.join(simon.AUDIO_DIR, f'test_gemini.{c["audio"].record_filetype}')
                 image = gr.Image(
                         value=image_path,
                         sources=None,
@@ -253,7 +278,7 @@ with gr.Blocks(theme=c['theme']) as demo:
             with gr.Row():
                 record_button = gr.Button("🎙️  record")
                 play_button = gr.Button("🔊  play")
-            slider = gr.Slider(0.0, 10.0, 4.0, label="🎙️ audio duration")
+            audio_slider = gr.Slider(0.0, 10.0, 4.0, label="🎙️ audio duration")
             audio = gr.Audio(
                 value=audio_path,
                 sources=None,
@@ -262,7 +287,7 @@ with gr.Blocks(theme=c['theme']) as demo:
                 type='filepath',
                 format=c['audio'].config.filetype,
             )
-            record_button.click(lambda d, n=audio_path: asyncio.run(c['audio'].async_record_audio(n, d)), inputs=[slider], outputs=[audio])
+            record_button.click(lambda d, n=audio_path: asyncio.run(c['audio'].async_record_audio(n, d)), inputs=[audio_slider], outputs=[audio])
             play_button.click(lambda n: asyncio.run(c['audio'].async_play_audio(n)), inputs=[audio])
         with gr.Column():
             with gr.Row():
@@ -271,6 +296,7 @@ with gr.Blocks(theme=c['theme']) as demo:
                     button_image = gr.Button("from image 📸", variant="primary")
                     button_audio = gr.Button("from audio 🎙️", variant="primary")
                     button_video = gr.Button("from video 🎥", variant="primary")
+                    button_fused = gr.Button("from image + audio 📸🎙️", variant="primary")
                 with gr.Row():
                     gr.Markdown("# Output")
                     textbox = gr.Textbox(show_label=False, placeholder="hola! hello! bonjour!")
@@ -289,6 +315,13 @@ with gr.Blocks(theme=c['theme']) as demo:
             button_image.click(partial(simon_says_from_image, image_path=image_path), outputs=[textbox])
             button_audio.click(partial(simon_says_from_audio, audio_path=audio_path), outputs=[textbox])
             button_video.click(partial(simon_says_from_video, video_path=video_path), outputs=[textbox])
+            button_fused.click(
+                partial(simon_says_from_image_and_audio, image_path, audio_path),
+                inputs=[audio_slider],
+                outputs=[image, audio, textbox],
+            )
+    # keep the gemini connection warm between turns
+    demo.load(c['gemini'].async_start_keepalive)
 
 demo.queue()
 demo.launch()
\ No newline at end of file
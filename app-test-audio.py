@@ -18,7 +18,7 @@ with gr.Blocks(theme=c['theme']) as demo:
                 button = gr.Button(f"{sound} multilingual")
                 button.click(lambda s=sound: asyncio.run(c['audio'].async_play_audio(s, multilingual=True)))
         with gr.Column():
-            audio_path = os.path.join(simon.AUDIO_DIR, f'test.{c["audio"].config.filetype}')
+            audio_path = os.path.join(simon.AUDIO_DIR, f'test.{c["audio"].record_filetype}')
             with gr.Row():
                 record_button = gr.Button("🎙️  record")
                 play_button = gr.Button("🔊  play")
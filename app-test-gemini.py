@@ -6,6 +6,7 @@ import os
 import gradio as gr
 
 import simon
+from simon.gemini import tool_outputs
 
 log = logging.getLogger('test-gemini')
 log.setLevel(logging.INFO)
@@ -37,24 +38,25 @@ TOOLS = {
     'shaka_sign': shaka_sign,
     'thumbs_up': thumbs_up,
 }
+c['gemini'].register_tools(TOOLS)
 
 async def use_tool_from_image(image_path: str) -> str:
     async with asyncio.TaskGroup() as tg:
         tg.create_task(c['audio'].async_play_audio('thinking', multilingual=True))
         result = tg.create_task(c['gemini'].async_process_image(image_path))
-    return await c['gemini'].async_use_tool(TOOLS, result.result())
+    return tool_outputs(await c['gemini'].async_use_tool(TOOLS, result.result()))
 
 async def use_tool_from_audio(audio_path: str) -> str:
     async with asyncio.TaskGroup() as tg:
         tg.create_task(c['audio'].async_play_audio('thinking', multilingual=True))
         result = tg.create_task(c['gemini'].async_process_audio(audio_path))
-    return await c['gemini'].async_use_tool(TOOLS, result.result())
+    return tool_outputs(await c['gemini'].async_use_tool(TOOLS, result.result()))
 
 async def use_tool_from_video(video_path: str) -> str:
     async with asyncio.TaskGroup() as tg:
         tg.create_task(c['audio'].async_play_audio('thinking', multilingual=True))
         result = tg.create_task(c['gemini'].async_process_video(video_path))
-    return await c['gemini'].async_use_tool(TOOLS, result.result())
+    return tool_outputs(await c['gemini'].async_use_tool(TOOLS, result.result()))
 
 with gr.Blocks(theme=c['theme']) as demo:
     gr.Markdown("# Gemini Test")
@@ -63,7 +65,7 @@ with gr.Blocks(theme=c['theme']) as demo:
             with gr.Row():
                 image_path = os.path.join(simon.IMAGE_DIR, f'test_gemini.{c["camera"].config.image_filetype}')
                 video_path = os.path.join(simon.IMAGE_DIR, f'test_gemini.{c["camera"].config.video_filetype}')
-                audio_path = os.path.join(simon.AUDIO_DIR, f'test_gemini.{c["audio"].config.filetype}')
+                audio_path = os.path.join(simon.AUDIO_DIR, f'test_gemini.{c["audio"].record_filetype}')
                 image = gr.Image(
                         value=image_path,
                         sources=None,
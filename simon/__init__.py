@@ -6,11 +6,14 @@ from typing import Any, Dict, List
 _this_dir: str = os.path.abspath(os.path.dirname(__file__))
 AUDIO_DIR: str = os.path.join(_this_dir, 'audio')
 IMAGE_DIR: str = os.path.join(_this_dir, 'image')
-# create audio and image directories if they don't exist
+CACHE_DIR: str = os.path.join(_this_dir, 'cache')
+# create audio, image and cache directories if they don't exist
 if not os.path.exists(AUDIO_DIR):
     os.makedirs(AUDIO_DIR)
 if not os.path.exists(IMAGE_DIR):
     os.makedirs(IMAGE_DIR)
+if not os.path.exists(CACHE_DIR):
+    os.makedirs(CACHE_DIR)
 
 def init(modules: List[str]) -> Dict[str, Any]:
     parser = argparse.ArgumentParser()
@@ -36,6 +39,7 @@ def init(modules: List[str]) -> Dict[str, Any]:
     log.debug(f"name {name}")
     log.debug(f"🗃️ Audio dir: {AUDIO_DIR}")
     log.debug(f"🗃️ Image dir: {IMAGE_DIR}")
+    log.debug(f"🗃️ Cache dir: {CACHE_DIR}")
     # main state of program is just a dict with singletons for optional modules
     c: Dict[str, Any] = {}
     if 'audio' in modules:
@@ -77,12 +81,21 @@ def init(modules: List[str]) -> Dict[str, Any]:
 
             if parsed_args.debug:
                 Gemini.async_file_api = async_timer(Gemini.async_file_api, 'gemini')
+                Gemini.async_media = async_timer(Gemini.async_media, 'gemini')
                 Gemini.async_process_audio = async_timer(Gemini.async_process_audio, 'gemini')
                 Gemini.async_process_video = async_timer(Gemini.async_process_video, 'gemini')
                 Gemini.async_process_image = async_timer(Gemini.async_process_image, 'gemini')
                 Gemini.async_use_tool = async_timer(Gemini.async_use_tool, 'gemini')
+                Gemini.async_perceive_and_act = async_timer(Gemini.async_perceive_and_act, 'gemini')
                 Gemini.change_model = timer(Gemini.change_model, 'gemini')
+                Gemini.register_tools = timer(Gemini.register_tools, 'gemini')
             c['gemini'] = Gemini()
+            # captures warm an idle connection so the request that follows skips connection setup
+            # and start loading their output so the upload is off the critical path
+            for module in ('camera', 'audio'):
+                if module in c:
+                    c[module].on_capture_start = c['gemini'].warm
+                    c[module].on_capture = c['gemini'].prefetch
         except ImportError as e:
             log.error(f"failed to import gemini: {str(e)}")
 
@@ -1,10 +1,21 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from array import array
+from collections import OrderedDict
 import asyncio
+import hashlib
+import io
+import itertools
+import json
 import logging
+import math
 import os
 import random
+import shutil
 import subprocess
-from typing import Dict, Tuple
+import threading
+import time
+import wave
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import pygame as audio_pygame
 
@@ -18,8 +29,17 @@ log.setLevel(logging.INFO)
 # ---- Audio
 # uses usb speaker and pygame audio mixer
 # to play .mp3 files in the assets/audio directory 
+# clips are decoded once into a memory budgeted sound bank
+# and played on named voices, each a pool of mixer channels
 # ----
 
+@dataclass(kw_only=True)
+class VoiceConfig(BaseConfig):
+    channels: int = 1 # clips on this voice that can overlap
+    priority: int = 0 # default priority of clips on this voice
+    queue: bool = False # a clip that cannot preempt waits for a free channel instead of being dropped
+    emoji: str = "🗣️"
+
 @dataclass(kw_only=True)
 class AudioConfig(BaseConfig):
     name: str
@@ -30,94 +50,530 @@ class AudioConfig(BaseConfig):
     default_audio_duration_record: float = 6.0
     async_audio_timeout: float = 6.0
     multilingual_choices: Tuple[str] = ("en", "es", "fr")
+    default_language: str = "en"
+    # index of the clip library, rebuilt for clips whose file changed
+    manifest_name: str = "manifest.json"
+    # decoded clips kept in memory, least recently played are evicted first
+    sound_bank_budget_mb: float = 64.0
+    preload_sounds: bool = True # decode the clip library in the background at startup
+    # a clip preempts the lowest priority clip on a full voice when its priority is higher
+    # equal priority clips queue, so concurrent tools speak one after another instead of cutting each other off
+    voices: Tuple[VoiceConfig, ...] = field(default_factory=lambda: (
+        VoiceConfig(name="speech", channels=1, priority=2, queue=True),
+        VoiceConfig(name="effects", channels=4, priority=1),
+        VoiceConfig(name="music", channels=1, priority=0, queue=True),
+    ))
+    default_voice: str = "speech"
+    voice_wait: float = 0.1 # seconds, recheck for a free channel on a queued voice at least this often
+    # streaming capture reads raw 16-bit pcm from arecord and stops on trailing silence
+    record_streaming: bool = True
+    # capture profile, samples are always 16-bit little endian
+    record_rate: int = 16000 # Hz
+    record_channels: int = 1
+    # recordings are encoded to this format, one of RECORD_ENCODERS or wav
+    record_filetype: str = "flac"
+    vad_frame: float = 0.03 # seconds of audio per energy measurement
+    vad_preroll: float = 0.3 # seconds kept from before speech starts
+    vad_min_speech: float = 0.5 # seconds of speech before trailing silence can end the capture
+    vad_trailing_silence: float = 0.7 # seconds
+    vad_start_frames: int = 2 # loud frames in a row that count as speech
+    vad_threshold_ratio: float = 3.0 # speech is this much louder than the noise floor
+    vad_min_rms: float = 300.0 # on 16-bit samples, floor for the speech threshold
+
+# encoder commands by file type, they read a wav on stdin and write {path}
+RECORD_ENCODERS: Dict[str, List[str]] = {
+    "flac": ["flac", "--silent", "--force", "--best", "-o", "{path}", "-"],
+    "ogg": ["opusenc", "--quiet", "--speech", "--bitrate", "24", "-", "{path}"],
+}
+
+class EnergyVAD:
+    """Frame energy voice activity detector with an adaptive noise floor and pre-roll."""
+
+    def __init__(self, config: AudioConfig):
+        self.config: AudioConfig = config
+        self.preroll: int = max(1, round(config.vad_preroll / config.vad_frame)) # frames kept when speech starts
+        # every frame until speech starts, bounded by the capture duration, then the pre-roll and speech
+        self.frames: List[bytes] = []
+        self.noise_floor: Optional[float] = None
+        self.loud: int = 0 # loud frames in a row before speech starts
+        self.speech: int = 0 # frames since speech started
+        self.silence: int = 0 # quiet frames in a row after speech started
+
+    @staticmethod
+    def rms(frame: bytes) -> float:
+        samples = array('h', frame)
+        return math.sqrt(sum(sample * sample for sample in samples) / max(1, len(samples)))
+
+    @property
+    def started(self) -> bool:
+        return self.speech > 0
+
+    def threshold(self) -> float:
+        return max(self.config.vad_min_rms, (self.noise_floor or 0.0) * self.config.vad_threshold_ratio)
+
+    def add(self, frame: bytes) -> bool:
+        # returns True once speech has ended
+        rms = self.rms(frame)
+        loud = rms > self.threshold()
+        if not self.started:
+            self.frames.append(frame)
+            if not loud:
+                # the floor only tracks audio from before speech
+                self.noise_floor = rms if self.noise_floor is None else 0.9 * self.noise_floor + 0.1 * rms
+                self.loud = 0
+                return False
+            self.loud += 1
+            if self.loud < self.config.vad_start_frames:
+                return False
+            log.debug(f"🎙️ speech started, rms {rms:.0f} over threshold {self.threshold():.0f}")
+            self.frames = self.frames[-self.preroll:]
+            self.speech = len(self.frames)
+            return False
+        self.frames.append(frame)
+        self.speech += 1
+        self.silence = 0 if loud else self.silence + 1
+        min_speech = self.config.vad_min_speech / self.config.vad_frame
+        trailing = self.config.vad_trailing_silence / self.config.vad_frame
+        return self.speech >= min_speech and self.silence >= trailing
+
+    def audio(self) -> bytes:
+        # no speech keeps the whole capture, quiet or missed speech is still sent rather than a fragment
+        return b"".join(self.frames)
+
+@dataclass
+class Playback:
+    name: str
+    priority: int
+    number: int # order the clip started in, older clips are preempted first
+    duration: float # seconds, cap on playback
+    future: asyncio.Future
+
+class SoundBank:
+    """LRU of decoded clips as pygame.mixer.Sound objects, bounded by decoded size in bytes."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes: int = budget_bytes
+        self.size_bytes: int = 0
+        # path -> (sound, decoded size in bytes, file mtime when decoded)
+        self.sounds: OrderedDict[str, Tuple[audio_pygame.mixer.Sound, int, float]] = OrderedDict()
+        # playback and the preload thread both touch the bank
+        self.lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def decoded_size(sound: audio_pygame.mixer.Sound) -> int:
+        frequency, size, channels = audio_pygame.mixer.get_init()
+        return int(sound.get_length() * frequency * channels * abs(size) // 8)
+
+    def get(self, path: str) -> Optional[audio_pygame.mixer.Sound]:
+        with self.lock:
+            if path not in self.sounds:
+                return None
+            sound, size, mtime = self.sounds[path]
+            if os.path.getmtime(path) != mtime:
+                # the file was rewritten, e.g. a new recording
+                del self.sounds[path]
+                self.size_bytes -= size
+                return None
+            self.sounds.move_to_end(path)
+            return sound
+
+    def load(self, path: str) -> audio_pygame.mixer.Sound:
+        if (sound := self.get(path)) is not None:
+            return sound
+        mtime = os.path.getmtime(path)
+        sound = audio_pygame.mixer.Sound(path)
+        size = self.decoded_size(sound)
+        with self.lock:
+            if path in self.sounds:
+                self.size_bytes -= self.sounds[path][1]
+            self.sounds[path] = (sound, size, mtime)
+            self.size_bytes += size
+            while self.size_bytes > self.budget_bytes and len(self.sounds) > 1:
+                evicted, (_, evicted_size, _) = self.sounds.popitem(last=False)
+                self.size_bytes -= evicted_size
+                log.debug(f"🏦 evicted sound {evicted}")
+        return sound
 
+    def preload(self, paths: List[str]):
+        for path in paths:
+            if self.size_bytes >= self.budget_bytes:
+                log.debug("🏦 sound bank full, stopped preloading")
+                break
+            try:
+                self.load(path)
+            except Exception as e:
+                log.warning(f"🏦 error decoding {path}: {str(e)}")
+        log.debug(f"🏦 preloaded {len(self.sounds)} sounds, {self.size_bytes / 2**20:.1f}MB")
+
+
+def clip_sample_rate(path: str) -> Optional[int]:
+    # native rate from the file header, the decoded sound always plays at the mixer rate
+    try:
+        if path.lower().endswith(".wav"):
+            with wave.open(path) as f:
+                return f.getframerate()
+        with open(path, 'rb') as f:
+            data = f.read(1 << 16)
+        start = 0
+        if data[:3] == b"ID3":
+            # skip the id3v2 tag, its size is syncsafe
+            start = 10 + ((data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f))
+        for i in range(start, len(data) - 3):
+            if data[i] != 0xff or data[i + 1] & 0xe0 != 0xe0:
+                continue
+            version, index = (data[i + 1] >> 3) & 3, (data[i + 2] >> 2) & 3
+            if version == 1 or index == 3:
+                continue
+            # mpeg 1, 2 and 2.5 frame sync
+            return (44100, 48000, 32000)[index] // {3: 1, 2: 2, 0: 4}[version]
+    except Exception as e:
+        log.warning(f"📇 error reading sample rate of {path}: {str(e)}")
+    return None
+
+class AudioManifest:
+    """JSON index of the clip library with each behavior's clips by language, duration, sample rate and hash."""
+
+    def __init__(self, directory: str, filetype: str, languages: Tuple[str], name: str = "manifest.json"):
+        self.directory: str = directory
+        self.filetype: str = filetype
+        self.languages: Tuple[str] = languages
+        self.path: str = os.path.join(directory, name)
+        # file name -> entry, entries are reused while the file mtime and size are unchanged
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # behavior -> language -> file name
+        self.clips: Dict[str, Dict[str, str]] = {}
+        self.load()
+
+    def split(self, name: str) -> Tuple[str, Optional[str]]:
+        # red_eyes_es -> (red_eyes, es), red_eyes -> (red_eyes, None)
+        stem = os.path.splitext(os.path.basename(name))[0]
+        behavior, _, language = stem.rpartition('_')
+        return (behavior, language) if behavior and language in self.languages else (stem, None)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)
+            self.index()
+        except Exception as e:
+            log.warning(f"📇 error loading audio manifest {self.path}: {str(e)}")
+            self.files = {}
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self.files, f, indent=1, sort_keys=True)
+        except Exception as e:
+            log.warning(f"📇 error saving audio manifest {self.path}: {str(e)}")
+
+    def index(self):
+        self.clips = {}
+        for file_name, entry in sorted(self.files.items()):
+            self.clips.setdefault(entry['behavior'], {})[entry['language']] = file_name
+
+    def refresh(self, decode: Callable[[str], audio_pygame.mixer.Sound]) -> bool:
+        # only stats the directory, clips are hashed and decoded when new or changed
+        changed = False
+        seen = set()
+        for item in os.scandir(self.directory):
+            if not item.is_file() or not item.name.lower().endswith(f".{self.filetype}"):
+                continue
+            seen.add(item.name)
+            stat = item.stat()
+            entry = self.files.get(item.name)
+            if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+            try:
+                with open(item.path, 'rb') as f:
+                    digest = hashlib.file_digest(f, 'sha256').hexdigest()
+                behavior, language = self.split(item.name)
+                self.files[item.name] = {
+                    'behavior': behavior,
+                    'language': language or "",
+                    'duration': decode(item.path).get_length(),
+                    'sample_rate': clip_sample_rate(item.path),
+                    'sha256': digest,
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size,
+                }
+                changed = True
+                log.debug(f"📇 indexed {item.name}")
+            except Exception as e:
+                log.warning(f"📇 error indexing {item.path}: {str(e)}")
+        for file_name in set(self.files) - seen:
+            del self.files[file_name]
+            changed = True
+        if changed:
+            self.save()
+        self.index()
+        return changed
+
+    def entry(self, behavior: str, language: str) -> Optional[Dict[str, Any]]:
+        file_name = self.clips.get(behavior, {}).get(language)
+        return None if file_name is None else self.files[file_name]
 
 class Audio:
 
     def __init__(self, config: AudioConfig = None):
         self.config: AudioConfig = config or AudioConfig(name="pygame")
-        self.default_audio_path = os.path.join(AUDIO_DIR, f"{self.config.default_audio_name}.{self.config.filetype}")
+        self.manifest: AudioManifest = AudioManifest(AUDIO_DIR, self.config.filetype, self.config.multilingual_choices, self.config.manifest_name)
+        # behavior name -> clip path in the default language, filled from the manifest on start
         self.sounds: Dict[str, str] = {}
-        for root, _, files in os.walk(AUDIO_DIR):
-            for file_name in files:
-                if file_name.lower().endswith(self.config.filetype):
-                    file_path = os.path.join(root, file_name)
-                    if os.path.exists(file_path):
-                        file_name = file_name.split('.')[0] # remove file extension
-                        if file_name.endswith('_es') or file_name.endswith('_fr'):
-                            continue # skip, only keep track of _en files
-                        log.debug(f"{self.config.emoji} sound [{file_name}] at {file_path}")
-                        self.sounds[file_name] = file_path
         # recording is done with arecord
         self.p: subprocess.Popen = None
+        # called with the output path when a capture starts, e.g. to warm the gemini connection
+        self.on_capture_start: Optional[Callable[[str], Any]] = None
+        # called with the output path when a capture completes, e.g. to start uploading it
+        self.on_capture: Optional[Callable[[str], Any]] = None
         self.record_cmd: str = ["arecord"]
+        self.record_profile: List[str] = ["-q", "-t", "raw", "-f", "S16_LE", "-c", str(self.config.record_channels), "-r", str(self.config.record_rate)]
+        self.record_filetype: str = self.config.record_filetype
+        if self.record_filetype != "wav" and shutil.which(RECORD_ENCODERS.get(self.record_filetype, [""])[0]) is None:
+            log.warning(f"{self.config.emoji} no encoder found for {self.record_filetype}, recordings are saved as wav")
+            self.record_filetype = "wav"
+        self.default_record_path = os.path.join(AUDIO_DIR, f"{self.config.default_audio_name}.{self.record_filetype}")
+        self.sound_bank: SoundBank = SoundBank(int(self.config.sound_bank_budget_mb * 2**20))
         self.start()
 
     def start(self):
         log.info(f"{self.config.emoji} started")
         audio_pygame.mixer.init()
+        # every voice gets its own reserved channels so voices never steal from each other
+        total = sum(voice.channels for voice in self.config.voices)
+        audio_pygame.mixer.set_num_channels(max(audio_pygame.mixer.get_num_channels(), total))
+        audio_pygame.mixer.set_reserved(total)
+        ids = itertools.count()
+        self.voices: Dict[str, VoiceConfig] = {voice.name: voice for voice in self.config.voices}
+        self.channels: Dict[str, List[int]] = {voice.name: [next(ids) for _ in range(voice.channels)] for voice in self.config.voices}
+        # channel id -> the clip it was last given
+        self.playing: Dict[int, Playback] = {}
+        self.plays = itertools.count(1)
+        if self.manifest.refresh(self.sound_bank.load):
+            log.info(f"📇 audio manifest rebuilt with {len(self.manifest.files)} clips")
+        for behavior in self.manifest.clips:
+            self.sounds[behavior] = self.clip_path(behavior)
+            log.debug(f"{self.config.emoji} sound [{behavior}] at {self.sounds[behavior]}")
+        if self.config.preload_sounds:
+            # every language variant of every behavior clip
+            paths = [os.path.join(AUDIO_DIR, file_name) for file_name in sorted(self.manifest.files)]
+            threading.Thread(target=self.sound_bank.preload, args=(paths,), daemon=True).start()
 
     def audio_description(self):
         return f"there are {len(self.sounds)} sounds: {', '.join(self.sounds.keys())}"
 
-    async def async_play_audio(self, name: str = None, duration: float = None, multilingual: bool = False) -> str:
-        """plays state['audio'] sound file with state['audio'] limited duration using async
+    def clip_language(self, name: str, multilingual: bool = False) -> Tuple[str, Optional[str]]:
+        # an explicit language suffix wins, then a random language, then the default language
+        behavior, language = self.manifest.split(name)
+        languages = self.manifest.clips.get(behavior, {})
+        if multilingual and languages:
+            language = random.choice([choice for choice in self.config.multilingual_choices if choice in languages] or list(languages))
+        if language not in languages:
+            language = self.config.default_language if self.config.default_language in languages else next(iter(languages), language)
+        return behavior, language
+
+    def clip_path(self, name: str, multilingual: bool = False) -> str:
+        behavior, language = self.clip_language(name, multilingual)
+        file_name = self.manifest.clips.get(behavior, {}).get(language)
+        return os.path.join(AUDIO_DIR, file_name or f"{name}.{self.config.filetype}")
+
+    def clip_duration(self, name: str, language: str = None) -> Optional[float]:
+        """decoded length in seconds of a behavior clip, without decoding it
 
         Args:
-            name (str): name of audio file
-            duration (float): max duration in seconds
-            multilingual (bool): if True, play audio a randomly chosen language!
+            name (str): behavior name, optionally with a language suffix
+            language (str): language of the clip, defaults to the suffix or the default language
         """
-        name = name or self.default_audio_path
+        behavior, suffix = self.clip_language(name)
+        entry = self.manifest.entry(behavior, language or suffix)
+        return None if entry is None else entry['duration']
+
+    def finish(self, channel_id: int, playback: Playback, stop: bool = False):
+        # runs on the loop that owns the playback future
+        if stop and self.playing.get(channel_id) is playback:
+            audio_pygame.mixer.Channel(channel_id).stop()
+            log.debug(f"{self.config.emoji} stopped audio after {playback.duration} seconds")
+        if not playback.future.done():
+            playback.future.set_result(playback.name)
+
+    async def async_acquire_channel(self, voice: str, priority: int) -> Optional[int]:
+        # a free channel on the voice, else preempt its lowest priority oldest clip if strictly lower, else wait or drop
+        while True:
+            channels = self.channels[voice]
+            for channel_id in channels:
+                if not audio_pygame.mixer.Channel(channel_id).get_busy():
+                    return channel_id
+            victim = min(channels, key=lambda channel_id: (self.playing[channel_id].priority, self.playing[channel_id].number) if channel_id in self.playing else (0, 0))
+            if victim not in self.playing or priority > self.playing[victim].priority:
+                log.debug(f"{self.voices[voice].emoji} {voice} preempting channel {victim}")
+                if (preempted := self.playing.get(victim)) is not None:
+                    preempted.future.get_loop().call_soon_threadsafe(self.finish, victim, preempted)
+                return victim
+            if not self.voices[voice].queue:
+                return None
+            # wake when a clip on this voice ends, plays started from other loops are rechecked after voice_wait
+            loop = asyncio.get_running_loop()
+            ending = [future for channel_id in channels if not (future := self.playing[channel_id].future).done() and future.get_loop() is loop]
+            await asyncio.wait(ending or [loop.create_future()], timeout=self.config.voice_wait, return_when=asyncio.FIRST_COMPLETED)
+
+    async def async_start_audio(self, name: str = None, duration: float = None, multilingual: bool = False, voice: str = None, priority: int = None) -> asyncio.Future:
+        """starts a sound and returns a future that resolves to its path when the clip ends
+
+        The end comes from the clip's decoded length, so chained behaviors continue within
+        a few milliseconds instead of waiting on a poll. A clip that is stopped at the
+        duration cap, preempted on its voice, dropped, or fails to play also resolves it.
+        """
+        voice = voice or self.config.default_voice
+        priority = self.voices[voice].priority if priority is None else priority
+        name = name or self.default_record_path
         duration = duration or self.config.default_audio_duration_play
-        if not name.endswith(self.config.filetype):
+        if not os.path.splitext(name)[1]:
             log.info(f"{self.config.emoji} playing sound [{name}]")
-            if multilingual:
-                name = name[:-3] # remove language modifier
-                name = f"{name}_{random.choice(self.config.multilingual_choices)}"
-            name = f"{name}.{self.config.filetype}"
-            if not name.startswith(AUDIO_DIR):
-                name = os.path.join(AUDIO_DIR, name)
+            name = self.clip_path(name, multilingual)
         else:
             log.info(f"{self.config.emoji} playing sound at filepath [{name}]")
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
         try:
-            audio_pygame.mixer.music.load(name)
-            audio_pygame.mixer.music.play()
-
-            end_time = asyncio.get_event_loop().time() + duration if duration > 0 else float('inf')
-            while audio_pygame.mixer.music.get_busy() and asyncio.get_event_loop().time() < end_time:
-                await asyncio.sleep(0.1)
-
-            if audio_pygame.mixer.music.get_busy():
-                audio_pygame.mixer.music.stop()
-                log.debug(f"{self.config.emoji} stopped audio after {duration} seconds")
-
+            if (sound := self.sound_bank.get(name)) is None:
+                # first play of this clip decodes it off the loop
+                sound = await asyncio.to_thread(self.sound_bank.load, name)
+            if (channel_id := await self.async_acquire_channel(voice, priority)) is None:
+                log.debug(f"{self.voices[voice].emoji} {voice} busy, dropped [{name}]")
+                future.set_result(name)
+                return future
+            playback = Playback(name=name, priority=priority, number=next(self.plays), duration=duration, future=future)
+            self.playing[channel_id] = playback
+            audio_pygame.mixer.Channel(channel_id).play(sound)
+            length = sound.get_length()
+            if duration > 0 and duration < length:
+                loop.call_later(duration, self.finish, channel_id, playback, True)
+            else:
+                loop.call_later(length, self.finish, channel_id, playback)
         except Exception as e:
             log.error(f"{self.config.emoji} error playing {name}: {str(e)}")
-        return name
+            if not future.done():
+                future.set_result(name)
+        return future
+
+    async def async_play_audio(self, name: str = None, duration: float = None, multilingual: bool = False, voice: str = None, priority: int = None) -> str:
+        """plays state['audio'] sound file with state['audio'] limited duration using async
+
+        Args:
+            name (str): name of audio file
+            duration (float): max duration in seconds
+            multilingual (bool): if True, play audio a randomly chosen language!
+            voice (str): mixer voice to play on, e.g. speech, effects or music
+            priority (int): overrides the voice priority, decides preemption on a full voice
+        """
+        return await (await self.async_start_audio(name, duration, multilingual, voice, priority))
 
     async def async_record_audio(self, name: str = None, duration: float = None) -> str:
-        name = name or self.default_audio_path
+        name = name or self.default_record_path
         duration = duration or self.config.default_audio_duration_record
-        if not name.endswith(self.config.filetype):
-            name = f"{name}.{self.config.filetype}"
-            if not name.startswith(AUDIO_DIR):
+        if not name.endswith(f".{self.record_filetype}"):
+            # recordings are always labelled with the format they are encoded in
+            name = f"{os.path.splitext(name)[0]}.{self.record_filetype}"
+            if not os.path.isabs(name):
                 name = os.path.join(AUDIO_DIR, name)
         log.info(f"{self.config.emoji} new audio [{name}]")
-        cmd = self.record_cmd + ["-d", str(int(duration)), name]
+        if self.on_capture_start is not None:
+            self.on_capture_start(name)
+        if self.config.record_streaming:
+            pcm = await self.async_stream_record(name, duration)
+        else:
+            pcm = await self.async_fixed_record(name, duration)
+        name = await self.async_encode(name, pcm)
+        if self.on_capture is not None:
+            self.on_capture(name)
+        return name
+
+    async def async_fixed_record(self, name: str, duration: float) -> bytes:
+        cmd = self.record_cmd + self.record_profile + ["-d", str(max(1, round(duration)))]
         log.debug(f"record cmd \n {' '.join(cmd)}")
         is_debug: bool = log.getEffectiveLevel() == logging.DEBUG
         self.p = await asyncio.create_subprocess_exec(
             *cmd,
-            stdin=asyncio.subprocess.PIPE if not is_debug else None,
-            stdout=asyncio.subprocess.PIPE if not is_debug else None,
-            stderr=asyncio.subprocess.PIPE if not is_debug else None,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=None if is_debug else asyncio.subprocess.DEVNULL,
         )
         try:
-            await asyncio.wait_for(self.p.wait(), timeout=duration + self.config.async_audio_timeout)
+            pcm, _ = await asyncio.wait_for(self.p.communicate(), timeout=duration + self.config.async_audio_timeout)
         except asyncio.TimeoutError:
             log.error(f"{self.config.emoji} audio recording timed out [{name}]")
             self.p.terminate()
+            await self.p.wait()
+            pcm = b""
+        return pcm
+
+    async def async_stream_record(self, name: str, duration: float) -> bytes:
+        # duration is the upper bound, the capture ends as soon as the speaker stops
+        cmd = self.record_cmd + self.record_profile
+        log.debug(f"record cmd \n {' '.join(cmd)}")
+        is_debug: bool = log.getEffectiveLevel() == logging.DEBUG
+        self.p = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=None if is_debug else asyncio.subprocess.DEVNULL,
+        )
+        frame_bytes = 2 * self.config.record_channels * round(self.config.record_rate * self.config.vad_frame)
+        vad = EnergyVAD(self.config)
+        end_time = asyncio.get_running_loop().time() + duration
+        try:
+            while (remaining := end_time - asyncio.get_running_loop().time()) > 0:
+                try:
+                    frame = await asyncio.wait_for(self.p.stdout.readexactly(frame_bytes), timeout=remaining + self.config.async_audio_timeout)
+                except asyncio.IncompleteReadError:
+                    log.error(f"{self.config.emoji} audio recording ended early [{name}]")
+                    break
+                except asyncio.TimeoutError:
+                    log.error(f"{self.config.emoji} audio recording timed out [{name}]")
+                    break
+                if vad.add(frame):
+                    log.debug(f"{self.config.emoji} speech ended after {len(vad.frames) * self.config.vad_frame:.2f}s")
+                    break
+        finally:
+            if self.p.returncode is None:
+                self.p.terminate()
+                await self.p.wait()
+        return vad.audio()
+
+    def wav_bytes(self, pcm: bytes) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as f:
+            f.setnchannels(self.config.record_channels)
+            f.setsampwidth(2)
+            f.setframerate(self.config.record_rate)
+            f.writeframes(pcm)
+        return buffer.getvalue()
+
+    def write_file(self, name: str, data: bytes):
+        with open(name, 'wb') as f:
+            f.write(data)
+
+    async def async_encode(self, name: str, pcm: bytes) -> str:
+        # encoders run as subprocesses, a failed encode falls back to a correctly named wav
+        wav = self.wav_bytes(pcm)
+        if self.record_filetype != "wav":
+            cmd = [arg.format(path=name) for arg in RECORD_ENCODERS[self.record_filetype]]
+            log.debug(f"encode cmd \n {' '.join(cmd)}")
+            start = time.time()
+            p = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await p.communicate(wav)
+            if p.returncode == 0:
+                log.debug(f"{self.config.emoji} encoded {len(wav)}B wav to {os.path.getsize(name)}B {self.record_filetype} in ⏳ {(time.time() - start) * 1000:.2f}ms")
+                return name
+            log.error(f"{self.config.emoji} error encoding {name}: {stderr.decode(errors='replace').strip()}")
+            name = f"{os.path.splitext(name)[0]}.wav"
+        await asyncio.to_thread(self.write_file, name, wav)
         return name
 
     def __del__(self):
@@ -3,6 +3,7 @@ import asyncio
 import logging
 import os
 import subprocess
+from typing import Any, Callable, Optional
 
 from simon import IMAGE_DIR
 from simon.utils import BaseConfig
@@ -39,6 +40,10 @@ class Camera:
         self.default_image_path = os.path.join(IMAGE_DIR, f"{self.config.default_image_name}.{self.config.image_filetype}")
         self.default_video_path = os.path.join(IMAGE_DIR, f"{self.config.default_video_name}.{self.config.video_filetype}")
         self.p: subprocess.Popen = None
+        # called with the output path when a capture starts, e.g. to warm the gemini connection
+        self.on_capture_start: Optional[Callable[[str], Any]] = None
+        # called with the output path when a capture completes, e.g. to start uploading it
+        self.on_capture: Optional[Callable[[str], Any]] = None
         self.image_cmd: str = [
             "rpicam-still", 
             "--width", 
@@ -72,6 +77,8 @@ class Camera:
         log_msg = f"new {'video' if is_video else 'image'}"
         log_msg += f" ({duration}s)" if is_video else ""
         log.info(f"{self.config.emoji} {log_msg} [{name}]")
+        if self.on_capture_start is not None:
+            self.on_capture_start(name)
         cmd = (self.video_cmd + ["-o", name, "-t", str(int(duration * 1000))]) if is_video else (self.image_cmd + ["--output", name])
         log.debug(f"{self.config.emoji} {'video' if is_video else 'image'} cmd \n {' '.join(cmd)}")
         is_debug: bool = log.getEffectiveLevel() == logging.DEBUG
@@ -98,6 +105,8 @@ class Camera:
                 self.p.terminate()
                 await self.p.wait()
             raise
+        if self.on_capture is not None:
+            self.on_capture(name)
         return name
 
     def __del__(self):
@@ -1,13 +1,30 @@
 import asyncio
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+from dataclasses import dataclass, field
+import datetime
+from functools import partial
+import hashlib
+import heapq
 import inspect
+import itertools
+import json
 import logging
+import math
+import mimetypes
 import os
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
 import google.generativeai as genai
-from google.generativeai.types import file_types
+from google.generativeai.types import content_types, file_types, generation_types
 
+from simon import CACHE_DIR
 from simon.utils import BaseConfig
 
 log = logging.getLogger('gemini')
@@ -22,115 +39,1330 @@ class GeminiConfig(BaseConfig):
     default_video_prompt: str = "describe this video in a short sentence. focus on what the people are doing."
     default_tool_system: str = "You are a function calling bot. Choose the best function based on a description of multimodal user input."
     emoji: str = "🪐"
-    file_api_max_retries: int = 8
+    # send media and tool declarations in one request instead of describe-then-act
+    perceive_and_act: bool = True
+    # stream tool responses and start each tool as soon as its function call arrives
+    stream_tools: bool = True
+    # tools run concurrently, a tool listed here waits for the tools it must follow
+    tool_order: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    # descriptions close to a past decision are dispatched locally without a model call
+    use_intents: bool = True
+    intent_cache_size: int = 256
+    intent_threshold: float = 0.7 # minimum n-gram jaccard similarity for a local match
+    # requests slower than the latency budget are hedged with a faster model, first answer wins
+    latency_budget: Optional[float] = 4.0 # seconds, None disables hedging
+    hedge_model: Optional[str] = "models/gemini-1.5-flash-latest"
+    latency_window: int = 256 # recent requests kept per model for percentiles
+    # token bucket shared by all requests, match this to the api key quota
+    rate_limit_rpm: Optional[float] = 60.0 # requests per minute, None disables
+    rate_limit_burst: int = 4
+    # system instruction and tool declarations are cached server side so turns only send the new content
+    # off by default, caching needs a versioned model (not -latest) and a context of at least the minimum size
+    use_context_cache: bool = False
+    context_cache_min_tokens: int = 32768
+    context_cache_ttl: float = 3600.0 # seconds
+    context_cache_refresh_margin: float = 300.0 # seconds, extend the ttl when this close to expiring
+    context_cache_retry_delay: float = 600.0 # seconds, wait after a failed create (e.g. context below the minimum size)
+    # every call is recorded in the ledger, a turn over budget gets trimmed prompts and downsized images
+    ledger_size: int = 4096
+    turn_token_budget: Optional[int] = None
+    budget_min_prompt_chars: int = 64
+    budget_image_max_side: int = 384
+    # the circuit breaker fails fast after repeated failures or slow answers, turns then fall back to local tools
+    request_timeout: float = 20.0 # seconds
+    breaker_failure_threshold: int = 3
+    breaker_latency_slo: float = 10.0 # seconds, slower answers count as failures
+    breaker_reset_timeout: float = 30.0 # seconds open before a half-open probe
+    degraded_fallback: bool = True
+    # a background ping keeps dns, tls and the channel warm while the robot sits idle
+    keepalive_interval: Optional[float] = 45.0 # seconds without traffic before a ping, None disables
+    warm_min_idle: float = 5.0 # seconds, a capture only triggers a ping after this much idle time
+    file_api_max_retries: Optional[int] = None # state polls, None polls until the deadline
     file_api_retry_delay: float = 0.01
+    file_api_max_retry_delay: float = 2.0 # seconds, cap on the backoff between state polls
+    file_api_deadline: float = 60.0 # seconds, give up on a file that never becomes ACTIVE
+    file_api_max_concurrent: int = 4 # uploads running at once
+    speculative_upload: bool = True # start loading media as soon as a capture completes
+    # uploaded files are reused while they are still valid on the server
+    file_cache_size: int = 64
+    file_cache_path: Optional[str] = None # json file, persists the cache across restarts
+    file_cache_expiry_margin: float = 300.0 # seconds, treat handles as expired this early
+    # identical requests are answered from an on-disk memo instead of the model
+    use_memo: bool = True
+    memo_path: Optional[str] = os.path.join(CACHE_DIR, "gemini_memo.sqlite") # None keeps the memo in memory
+    memo_ttl: float = 24 * 3600.0 # seconds
+    memo_max_entries: int = 4096
+    # media up to this size is sent inline with the request instead of through the file api
+    inline_max_bytes: int = 2 * 1024 * 1024
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+class FileCache:
+    """LRU cache of uploaded file handles keyed by content hash, mime type and size."""
+
+    def __init__(self, max_size: int = 64, path: Optional[str] = None, expiry_margin: float = 300.0):
+        self.max_size: int = max_size
+        self.path: Optional[str] = path
+        self.expiry_margin: float = expiry_margin
+        # key -> (file handle, expiration unix timestamp)
+        self.files: OrderedDict[str, Tuple[file_types.File, float]] = OrderedDict()
+        self.load()
+
+    @staticmethod
+    def key(file_path: str) -> str:
+        mime_type, _ = mimetypes.guess_type(file_path)
+        with open(file_path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        return f"{digest}:{mime_type}:{os.path.getsize(file_path)}"
+
+    def get(self, key: str) -> Optional[file_types.File]:
+        if key not in self.files:
+            return None
+        file, expiration = self.files[key]
+        if time.time() + self.expiry_margin >= expiration:
+            log.debug(f"💾 cached file {file.name} expired")
+            del self.files[key]
+            self.save()
+            return None
+        self.files.move_to_end(key)
+        return file
+
+    def put(self, key: str, file: file_types.File):
+        self.files[key] = (file, file.expiration_time.timestamp())
+        self.files.move_to_end(key)
+        while len(self.files) > self.max_size:
+            _, (evicted, _) = self.files.popitem(last=False)
+            log.debug(f"💾 evicted cached file {evicted.name}")
+        self.save()
+
+    def clear(self):
+        self.files.clear()
+        self.save()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            for key, entry in entries.items():
+                proto = genai.protos.File(
+                    name=entry['name'],
+                    display_name=entry['display_name'],
+                    mime_type=entry['mime_type'],
+                    uri=entry['uri'],
+                    state=genai.protos.File.State.ACTIVE,
+                )
+                self.files[key] = (file_types.File(proto), entry['expiration'])
+            log.debug(f"💾 loaded {len(self.files)} cached files from {self.path}")
+        except Exception as e:
+            log.warning(f"💾 error loading file cache {self.path}: {str(e)}")
+
+    def save(self):
+        if self.path is None:
+            return
+        entries = {
+            key: {
+                'name': file.name,
+                'display_name': file.display_name,
+                'mime_type': file.mime_type,
+                'uri': file.uri,
+                'expiration': expiration,
+            } for key, (file, expiration) in self.files.items()
+        }
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(entries, f)
+        except Exception as e:
+            log.warning(f"💾 error saving file cache {self.path}: {str(e)}")
+
+def _jsonable(value: Any) -> Any:
+    # proto map and repeated values in function call args
+    return dict(value) if hasattr(value, 'keys') else list(value)
+
+class ResponseMemo:
+    """SQLite store of responses keyed by request, with a ttl and least recently used eviction."""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 24 * 3600.0, max_entries: int = 4096):
+        self.path: str = path or ":memory:"
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        # gemini is used from the gradio loop and from worker threads
+        self.lock: threading.Lock = threading.Lock()
+        # opened on first use, so a client with the memo disabled never creates the file
+        self.db: Optional[sqlite3.Connection] = None
+        # access times of hits, written with the next put instead of one commit per hit
+        self.accessed: Dict[str, float] = {}
+
+    def connect(self) -> sqlite3.Connection:
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS memo_accessed ON memo (accessed)")
+            self.db.commit()
+        return self.db
+
+    def get(self, key: str) -> Optional[Any]:
+        # read only, expired rows are pruned by the next put
+        now = time.time()
+        with self.lock:
+            row = self.connect().execute("SELECT value, created FROM memo WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.accessed[key] = now
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        with self.lock:
+            db = self.connect()
+            db.executemany("UPDATE memo SET accessed = ? WHERE key = ?", [(t, k) for k, t in self.accessed.items()])
+            self.accessed.clear()
+            db.execute("INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)", (key, json.dumps(value, default=_jsonable), now, now))
+            db.execute("DELETE FROM memo WHERE created < ?", (now - self.ttl,))
+            db.execute(
+                "DELETE FROM memo WHERE key IN (SELECT key FROM memo ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            db.commit()
+
+    async def async_get(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def async_put(self, key: str, value: Any):
+        await asyncio.to_thread(self.put, key, value)
+
+    def clear(self):
+        with self.lock:
+            self.accessed.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM memo")
+                self.db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            (entries,) = self.db.execute("SELECT COUNT(*) FROM memo").fetchone() if self.db is not None else (0,)
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+@dataclass
+class ToolCall:
+    name: str
+    args: Dict[str, Any]
+
+@dataclass
+class ToolResult:
+    name: str
+    args: Dict[str, Any]
+    output: Any = None
+    error: Optional[str] = None
+    start: float = 0.0 # seconds after dispatch began
+    elapsed: float = 0.0 # seconds
+    degraded: bool = False # chosen locally by the fallback, not by the model
+
+def tool_outputs(results: List[ToolResult]) -> str:
+    outputs = [str(result.output) for result in results if result.output is not None]
+    return " ".join(outputs) or "❓"
+
+async def list_calls(calls: List[Any]) -> AsyncIterator[Any]:
+    for fn in calls:
+        yield fn
+
+async def response_calls(response: Any, stream: bool = False) -> AsyncIterator[Any]:
+    # function calls from a response, a streamed response yields each call as its chunk arrives
+    if not stream:
+        for part in response.parts:
+            if fn := part.function_call:
+                yield fn
+        return
+    async for chunk in stream_chunks(response):
+        for part in chunk.parts:
+            if fn := part.function_call:
+                yield fn
+
+async def stream_chunks(response: Any) -> AsyncIterator[Any]:
+    # the sdk's own iterator reads one chunk ahead before yielding, so a function call would only be
+    # dispatched once the next chunk arrived, this yields each chunk as it arrives and keeps the
+    # response's joined result current so text and usage read the same once the stream is done
+    if isinstance(response, TimedStream):
+        response = response.response
+    if not isinstance(response, generation_types.AsyncGenerateContentResponse) or response._done:
+        async for chunk in response:
+            yield chunk
+        return
+    for chunk in list(response._chunks):
+        if response._error:
+            raise response._error
+        yield generation_types.GenerateContentResponse.from_response(chunk)
+    while True:
+        try:
+            with generation_types.rewrite_stream_error():
+                item = await anext(response._iterator)
+        except StopAsyncIteration:
+            response._done = True
+            return
+        except Exception as e:
+            response._error = e
+            response._done = True
+            raise
+        response._chunks.append(item)
+        response._result = generation_types._join_chunks([response._result, item])
+        yield generation_types.GenerateContentResponse.from_response(item)
+
+class TimedStream:
+    """Streamed response that reports success, failure or cancellation once iteration ends."""
+
+    def __init__(self, response: Any, finish: Callable[[Optional[BaseException]], None]):
+        self.response: Any = response
+        self.finish: Callable[[Optional[BaseException]], None] = finish
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.response, name)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        try:
+            async for chunk in stream_chunks(self.response):
+                yield chunk
+        except BaseException as e:
+            self.finish(e)
+            raise
+        self.finish()
+
+# words that flip a decision on their own, descriptions only match when these agree in order
+INTENT_KEY_WORDS: frozenset = frozenset((
+    "left", "right", "both", "up", "down", "raised", "raise", "raising", "lowered", "lower", "lowering",
+    "above", "below", "over", "under", "not", "no", "never", "neither", "nor", "without",
+    "red", "green", "blue", "open", "closed", "blink", "blinking", "wave", "waving", "nod", "shake", "turn", "turned",
+))
+
+class IntentCache:
+    """Maps descriptions to past tool decisions using word n-gram overlap, gated on direction, side and negation words."""
+
+    def __init__(self, max_size: int = 256, threshold: float = 0.8, ngram: int = 2):
+        self.max_size: int = max_size
+        self.threshold: float = threshold
+        self.ngram: int = ngram
+        # normalized description -> (key words, n-gram features, tool calls)
+        self.intents: OrderedDict[str, Tuple[Tuple[str, ...], frozenset, List[ToolCall]]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = re.sub(r"n['’]t\b", " not", text.lower())
+        return " ".join(re.findall(r"[a-z0-9]+", text))
+
+    @staticmethod
+    def key(text: str) -> Tuple[str, ...]:
+        return tuple(word for word in text.split() if word in INTENT_KEY_WORDS)
+
+    def features(self, text: str) -> frozenset:
+        words = text.split()
+        return frozenset(
+            " ".join(words[i:i + n])
+            for n in range(1, self.ngram + 1)
+            for i in range(len(words) - n + 1)
+        )
+
+    def match(self, text: str, tools: Dict[str, Union[Callable, Awaitable]]) -> Optional[List[ToolCall]]:
+        text = self.normalize(text)
+        best_calls, best_score = None, 0.0
+        if text in self.intents:
+            best_calls, best_score = self.intents[text][2], 1.0
+        else:
+            key, features = self.key(text), self.features(text)
+            for other_text, (other_key, other, calls) in self.intents.items():
+                # "left arm raised" must never answer for "right arm raised"
+                if other_key != key or not features or not other:
+                    continue
+                score = len(features & other) / len(features | other)
+                if score > best_score:
+                    best_calls, best_score, text = calls, score, other_text
+        if best_calls and best_score >= self.threshold and all(call.name in tools for call in best_calls):
+            self.hits += 1
+            self.intents.move_to_end(text)
+            log.debug(f"🧭 intent hit {[call.name for call in best_calls]} score={best_score:.2f}")
+            return best_calls
+        self.misses += 1
+        return None
+
+    def add(self, text: str, calls: List[ToolCall]):
+        if not calls:
+            return
+        text = self.normalize(text)
+        self.intents[text] = (self.key(text), self.features(text), calls)
+        self.intents.move_to_end(text)
+        while len(self.intents) > self.max_size:
+            self.intents.popitem(last=False)
+
+    def recent(self, tools: Dict[str, Union[Callable, Awaitable]]) -> Optional[List[ToolCall]]:
+        for _, _, calls in reversed(self.intents.values()):
+            if all(call.name in tools for call in calls):
+                return calls
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.intents)}
+
+class LatencyStats:
+    """Rolling window of request latencies per model."""
+
+    def __init__(self, window: int = 256):
+        self.window: int = window
+        self.latencies: Dict[str, deque] = {}
+        self.censored: Dict[str, deque] = {}
+
+    def record(self, model_name: str, seconds: float, censored: bool = False):
+        # a censored latency is a lower bound, e.g. a request cancelled after losing a hedge race
+        # it stays in the window so slow models are not made to look fast by dropping their slowest requests
+        self.latencies.setdefault(model_name, deque(maxlen=self.window)).append(seconds)
+        self.censored.setdefault(model_name, deque(maxlen=self.window)).append(censored)
+
+    def percentile(self, model_name: str, q: float) -> Optional[float]:
+        latencies = sorted(self.latencies.get(model_name, ()))
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            model_name: {
+                "count": len(latencies),
+                "p50": self.percentile(model_name, 0.50),
+                "p95": self.percentile(model_name, 0.95),
+                "censored": sum(self.censored.get(model_name, ())),
+            } for model_name, latencies in self.latencies.items()
+        }
+
+# lower value is served first when requests are waiting on the rate limiter
+PRIORITY_INTERACTIVE: int = 0
+PRIORITY_BATCH: int = 1
+request_priority: contextvars.ContextVar = contextvars.ContextVar('request_priority', default=PRIORITY_INTERACTIVE)
+# set to True to skip the response memo for requests made in this context
+memo_bypass: contextvars.ContextVar = contextvars.ContextVar('memo_bypass', default=False)
+
+def request_key(contents: Any, *extra: Any) -> str:
+    # identifies a request by its media content, prompt and settings
+    h = hashlib.sha256()
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, dict) and 'data' in item:
+            h.update(str(item.get('mime_type')).encode())
+            h.update(hashlib.sha256(item['data']).digest())
+        elif isinstance(item, file_types.File):
+            h.update(item.uri.encode())
+        else:
+            h.update(repr(item).encode())
+    for e in extra:
+        h.update(repr(e).encode())
+    return h.hexdigest()
+
+class Scheduler:
+    """Token bucket rate limiter with priority classes and coalescing of identical in-flight requests."""
+
+    def __init__(self, rpm: Optional[float] = 60.0, burst: int = 4):
+        self.rate: Optional[float] = rpm / 60.0 if rpm else None # tokens per second
+        self.burst: int = burst
+        self.tokens: float = float(burst)
+        self.updated: float = time.monotonic()
+        # heap of (priority, sequence, future) for requests waiting on a token
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.sequence = itertools.count()
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.coalesced: int = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority: int = None):
+        if not self.rate:
+            return
+        priority = request_priority.get() if priority is None else priority
+        self.refill()
+        if not self.waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        log.debug(f"🚦 rate limited, {len(self.waiters)} waiting")
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.async_dispatch())
+        await future
+
+    async def async_dispatch(self):
+        while self.waiters:
+            self.refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done(): # cancelled waiters give their turn away
+                self.tokens -= 1
+                future.set_result(None)
+
+    async def coalesce(self, key: str, coro_fn: Callable[[], Awaitable]) -> Any:
+        if key in self.in_flight:
+            self.coalesced += 1
+            log.debug(f"🚦 coalesced with in-flight request {key[:8]}")
+        else:
+            task = asyncio.ensure_future(coro_fn())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(self.in_flight[key])
+
+class GeminiBackend:
+    """Every call Gemini makes to the api, swap in a local stand-in (simon/gemini_fake.py) to run offline."""
+
+    def configure(self, api_key: Optional[str]):
+        genai.configure(api_key=api_key)
+
+    def get_model(self, model_name: str) -> Any:
+        return genai.get_model(model_name)
+
+    def upload_file(self, path: str, display_name: str = None) -> file_types.File:
+        return genai.upload_file(path=path, display_name=display_name)
+
+    def get_file(self, name: str) -> file_types.File:
+        return genai.get_file(name)
+
+    def generative_model(
+        self,
+        model_name: str,
+        system_instruction: str = None,
+        tools: content_types.FunctionLibrary = None,
+        tool_config: Dict[str, Any] = None,
+        ) -> genai.GenerativeModel:
+        return genai.GenerativeModel(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            tools=tools,
+            tool_config=tool_config,
+        )
+
+    def create_cached_content(
+        self,
+        model: str,
+        display_name: str,
+        system_instruction: str,
+        tools: content_types.FunctionLibrary,
+        tool_config: Dict[str, Any],
+        ttl: datetime.timedelta,
+        ) -> genai.caching.CachedContent:
+        return genai.caching.CachedContent.create(
+            model=model,
+            display_name=display_name,
+            system_instruction=system_instruction,
+            tools=tools,
+            tool_config=tool_config,
+            ttl=ttl,
+        )
+
+    def model_from_cached_content(self, cached_content: genai.caching.CachedContent) -> genai.GenerativeModel:
+        return genai.GenerativeModel.from_cached_content(cached_content)
+
+# log prefix per kind of media processed on its own
+MEDIA_EMOJIS: Dict[str, str] = {"audio": "🎙️", "image": "📷", "video": "📹"}
+
+# rough token cost of one media part, gemini 1.5 bills an image as 258 tokens
+MEDIA_TOKENS: int = 258
+
+def media_bytes(media: Any) -> int:
+    if isinstance(media, dict) and 'data' in media:
+        return len(media['data'])
+    if isinstance(media, file_types.File):
+        return media.size_bytes
+    return 0
+
+def downsize_image(media: Any, max_side: int) -> Any:
+    # only inline images can be downsized, pillow is optional
+    if not (isinstance(media, dict) and str(media.get('mime_type')).startswith('image/')):
+        return media
+    try:
+        import io
+        from PIL import Image
+        image = Image.open(io.BytesIO(media['data']))
+        if max(image.size) <= max_side:
+            return media
+        image.thumbnail((max_side, max_side))
+        buffer = io.BytesIO()
+        image.save(buffer, format=image.format or 'PNG')
+        return {"mime_type": media['mime_type'], "data": buffer.getvalue()}
+    except ImportError as e:
+        log.warning(f"🧾 cannot downsize image: {str(e)}")
+        return media
+
+@dataclass
+class LedgerEntry:
+    entry_point: str
+    model: str
+    prompt_tokens: int
+    output_tokens: int
+    media_bytes: int
+    wall_time: float # seconds
+    turn: int
+    timestamp: float
+
+class Ledger:
+    """In-process record of tokens, media bytes and wall time for every Gemini call."""
+
+    def __init__(self, max_entries: int = 4096):
+        self.entries: deque = deque(maxlen=max_entries)
+        self.turn: int = 0
+
+    def begin_turn(self) -> int:
+        self.turn += 1
+        return self.turn
+
+    def record(self, entry: LedgerEntry):
+        self.entries.append(entry)
+        log.debug(f"🧾 {entry.entry_point} {entry.model} in={entry.prompt_tokens} out={entry.output_tokens} bytes={entry.media_bytes} ⏳ {entry.wall_time:.2f}s")
+
+    def query(self, entry_point: str = None, model: str = None, turn: int = None, since: float = None) -> List[LedgerEntry]:
+        return [
+            entry for entry in self.entries
+            if (entry_point is None or entry.entry_point == entry_point)
+            and (model is None or entry.model == model)
+            and (turn is None or entry.turn == turn)
+            and (since is None or entry.timestamp >= since)
+        ]
+
+    def turn_tokens(self, turn: int = None) -> int:
+        turn = self.turn if turn is None else turn
+        return sum(entry.prompt_tokens + entry.output_tokens for entry in self.query(turn=turn))
+
+    def summary(self, by: str = "model") -> Dict[str, Dict[str, float]]:
+        # aggregates keyed by "model" or "entry_point"
+        totals: Dict[str, Dict[str, float]] = {}
+        for entry in self.entries:
+            total = totals.setdefault(getattr(entry, by), {
+                "calls": 0, "prompt_tokens": 0, "output_tokens": 0, "media_bytes": 0, "wall_time": 0.0,
+            })
+            total["calls"] += 1
+            total["prompt_tokens"] += entry.prompt_tokens
+            total["output_tokens"] += entry.output_tokens
+            total["media_bytes"] += entry.media_bytes
+            total["wall_time"] += entry.wall_time
+        for total in totals.values():
+            total["mean_wall_time"] = total["wall_time"] / total["calls"]
+        return totals
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Opens after consecutive failures or latency slo violations, a single probe is let through after a cooldown."""
+
+    def __init__(self, failure_threshold: int = 3, latency_slo: float = 10.0, reset_timeout: float = 30.0):
+        self.failure_threshold: int = failure_threshold
+        self.latency_slo: float = latency_slo
+        self.reset_timeout: float = reset_timeout
+        self.state: str = "closed" # closed, open, half_open
+        self.failures: int = 0
+        self.opened_at: float = 0.0
+        self.probing: bool = False
+
+    def blocked(self) -> bool:
+        # open and still cooling down, or a half-open probe is already in flight
+        if self.state == "open":
+            return time.monotonic() - self.opened_at < self.reset_timeout
+        return self.state == "half_open" and self.probing
+
+    def allow(self) -> bool:
+        if self.blocked():
+            return False
+        if self.state == "open":
+            log.info("🔌 circuit half-open, probing")
+            self.state = "half_open"
+        if self.state == "half_open":
+            self.probing = True
+        return True
+
+    def record_success(self, latency: float):
+        if latency > self.latency_slo:
+            log.warning(f"🔌 answer took {latency:.2f}s, over the {self.latency_slo}s slo")
+            self.record_failure()
+            return
+        if self.state != "closed":
+            log.info("🔌 circuit closed")
+        self.state, self.failures, self.probing = "closed", 0, False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                log.warning(f"🔌 circuit open after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
 
 class Gemini:
 
-    def __init__(self, config: GeminiConfig = None):
+    def __init__(self, config: GeminiConfig = None, backend: GeminiBackend = None):
         self.config: GeminiConfig = config or GeminiConfig(name="gemini")
+        self.backend: GeminiBackend = backend or GeminiBackend()
         if 'GOOGLE_API_KEY' not in os.environ:
             log.warning("GOOGLE_API_KEY not found in environment variables")
-        genai.configure(api_key=os.environ.get('GOOGLE_API_KEY'))
+        self.backend.configure(api_key=os.environ.get('GOOGLE_API_KEY'))
+        self.file_cache: FileCache = FileCache(
+            max_size=self.config.file_cache_size,
+            path=self.config.file_cache_path,
+            expiry_margin=self.config.file_cache_expiry_margin,
+        )
+        self.memo: ResponseMemo = ResponseMemo(
+            path=self.config.memo_path,
+            ttl=self.config.memo_ttl,
+            max_entries=self.config.memo_max_entries,
+        )
+        self.intent_cache: IntentCache = IntentCache(
+            max_size=self.config.intent_cache_size,
+            threshold=self.config.intent_threshold,
+        )
+        self.latency: LatencyStats = LatencyStats(window=self.config.latency_window)
+        # how each request was answered: primary in budget, hedge won, primary won after hedging
+        self.routes: Dict[str, int] = {"primary": 0, "hedge": 0, "primary_after_hedge": 0}
+        self.breaker: CircuitBreaker = CircuitBreaker(
+            failure_threshold=self.config.breaker_failure_threshold,
+            latency_slo=self.config.breaker_latency_slo,
+            reset_timeout=self.config.breaker_reset_timeout,
+        )
+        self.ledger: Ledger = Ledger(max_entries=self.config.ledger_size)
+        self.scheduler: Scheduler = Scheduler(rpm=self.config.rate_limit_rpm, burst=self.config.rate_limit_burst)
+        # loop the requests and keepalive run on, captures in other threads schedule pings onto it
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.keepalive_task: Optional[asyncio.Task] = None
+        self.last_request: float = 0.0
+        self.connected: bool = False
+        # speculative media loads keyed by path, with the (mtime, size) of the file they read
+        self.prefetches: Dict[str, Tuple[Tuple[int, int], Future]] = {}
+        self.upload_executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self.config.file_api_max_concurrent,
+            thread_name_prefix="gemini-upload",
+        )
+        # models are reused per (model name, system instruction, tool set)
+        self.models: Dict[Tuple[str, Optional[str], Tuple[str, ...]], genai.GenerativeModel] = {}
+        # server side context caches per (model name, system instruction, tool set) and their expiry
+        self.context_caches: Dict[Tuple[str, Optional[str], Tuple[str, ...]], Tuple[genai.caching.CachedContent, float]] = {}
+        self.context_cache_retry: Dict[Tuple[str, Optional[str], Tuple[str, ...]], float] = {}
+        # caches are created and refreshed off the turn, at most one task per key
+        self.context_cache_tasks: Dict[Tuple[str, Optional[str], Tuple[str, ...]], asyncio.Task] = {}
+        # tool declarations are introspected once per tool set
+        self.tool_libraries: Dict[Tuple[str, ...], content_types.FunctionLibrary] = {}
         self.change_model(self.config.default_model)
         log.info(f"{self.config.emoji} started")
 
     def change_model(self, model_name: str) -> str:
         log.info(f"{self.config.emoji} using model {model_name}")
-        model_info = genai.get_model(model_name)
+        model_info = self.backend.get_model(model_name)
         log.debug(model_info)
         self.model_name = model_name
+        self.models.clear()
         return str(model_info)
 
+    def register_tools(self, tools: Dict[str, Union[Callable, Awaitable]]) -> content_types.FunctionLibrary:
+        key = tuple(tools.keys())
+        if key not in self.tool_libraries:
+            log.debug(f"🧰 building declarations for {len(key)} tools")
+            self.tool_libraries[key] = content_types.to_function_library(list(tools.values()))
+        return self.tool_libraries[key]
+
+    def tool_config(self, tools: Dict[str, Union[Callable, Awaitable]]) -> Dict[str, Any]:
+        # https://ai.google.dev/gemini-api/docs/function-calling#function_calling_mode
+        return {"function_calling_config": {
+            "mode": "ANY",
+            "allowed_function_names": list(tools.keys()),
+        }}
+
+    def cached_model(
+        self,
+        model_name: str = None,
+        system: str = None,
+        tools: Dict[str, Union[Callable, Awaitable]] = None,
+        ) -> genai.GenerativeModel:
+        model_name = model_name or self.model_name
+        key = (model_name, system, tuple(tools.keys()) if tools else ())
+        if key not in self.models:
+            log.debug(f"🧠 new model {model_name} with {len(key[2])} tools")
+            self.models[key] = self.backend.generative_model(
+                model_name=model_name,
+                system_instruction=system,
+                tools=self.register_tools(tools) if tools else None,
+                tool_config=self.tool_config(tools) if tools else None,
+            )
+        return self.models[key]
+
+    def context_tokens(self, system: Optional[str], tools: Dict[str, Union[Callable, Awaitable]]) -> int:
+        # rough local estimate of the cacheable context, about four characters per token
+        declarations = sum(len(type(tool).to_json(tool)) for tool in self.register_tools(tools).to_proto())
+        return (len(system or "") + declarations) // 4
+
+    async def async_cached_model(
+        self,
+        model_name: str = None,
+        system: str = None,
+        tools: Dict[str, Union[Callable, Awaitable]] = None,
+        ) -> genai.GenerativeModel:
+        # tool models use a server side context cache when one is ready, otherwise the plain model
+        # while a background task creates or refreshes the cache, the turn never waits on it
+        model_name = model_name or self.model_name
+        if not tools or not self.config.use_context_cache:
+            return self.cached_model(model_name, system, tools)
+        key = (model_name, system, tuple(tools.keys()))
+        now = time.time()
+        cache, expiration = self.context_caches.get(key, (None, 0))
+        if (cache is None or expiration - now < self.config.context_cache_refresh_margin) and self.context_cache_retry.get(key, 0) <= now:
+            task = self.context_cache_tasks.get(key)
+            if task is None or task.done():
+                self.context_cache_tasks[key] = asyncio.create_task(self.async_refresh_context_cache(key, tools))
+        if cache is None or expiration <= now:
+            return self.cached_model(model_name, system, tools)
+        cached_key = (model_name, cache.name, ())
+        if cached_key not in self.models:
+            self.models[cached_key] = self.backend.model_from_cached_content(cache)
+        return self.models[cached_key]
+
+    async def async_refresh_context_cache(
+        self,
+        key: Tuple[str, Optional[str], Tuple[str, ...]],
+        tools: Dict[str, Union[Callable, Awaitable]],
+        ):
+        model_name, system, _ = key
+        now = time.time()
+        if model_name.endswith("-latest"):
+            log.debug(f"🗄️ no context cache for {model_name}, caching needs a versioned model")
+            self.context_cache_retry[key] = math.inf
+            return
+        tokens = self.context_tokens(system, tools)
+        if tokens < self.config.context_cache_min_tokens:
+            log.debug(f"🗄️ no context cache, ~{tokens} tokens is under the {self.config.context_cache_min_tokens} minimum")
+            self.context_cache_retry[key] = math.inf
+            return
+        try:
+            cache, expiration = self.context_caches.get(key, (None, 0))
+            if cache is None or expiration <= now:
+                cache = await asyncio.to_thread(
+                    self.backend.create_cached_content,
+                    model=model_name,
+                    display_name=f"simon-{len(key[2])}-tools",
+                    system_instruction=system,
+                    tools=self.register_tools(tools),
+                    tool_config=self.tool_config(tools),
+                    ttl=datetime.timedelta(seconds=self.config.context_cache_ttl),
+                )
+                log.debug(f"🗄️ created context cache {cache.name}")
+            else:
+                await asyncio.to_thread(cache.update, ttl=datetime.timedelta(seconds=self.config.context_cache_ttl))
+                log.debug(f"🗄️ refreshed context cache {cache.name}")
+            self.context_caches[key] = (cache, cache.expire_time.timestamp())
+        except Exception as e:
+            log.debug(f"🗄️ context cache unavailable, sending full context: {str(e)}")
+            self.context_caches.pop(key, None)
+            self.context_cache_retry[key] = now + self.config.context_cache_retry_delay
+
+    async def async_timed_generate(
+        self,
+        contents: Any,
+        model_name: str,
+        system: str = None,
+        tools: Dict[str, Union[Callable, Awaitable]] = None,
+        stream: bool = False,
+        ) -> Any:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"gemini unavailable, circuit {self.breaker.state}")
+        probe = self.breaker.state == "half_open"
+        start: Optional[float] = None
+        try:
+            model = await self.async_cached_model(model_name, system, tools)
+            await self.scheduler.acquire()
+            start = time.time()
+            response = await asyncio.wait_for(model.generate_content_async(contents, stream=stream), self.config.request_timeout)
+        except asyncio.CancelledError:
+            # a cancelled probe must still settle the half-open state or the circuit never closes
+            if probe:
+                self.breaker.record_failure()
+            if start is not None:
+                self.latency.record(model_name, time.time() - start, censored=True)
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.last_request = time.monotonic()
+        self.connected = True
+        await self.async_start_keepalive()
+
+        def finish(error: Optional[BaseException] = None):
+            if error is None:
+                self.breaker.record_success(time.time() - start)
+                self.latency.record(model_name, time.time() - start)
+            elif not isinstance(error, (asyncio.CancelledError, GeneratorExit)) or probe:
+                self.breaker.record_failure()
+            else:
+                self.latency.record(model_name, time.time() - start, censored=True)
+
+        if stream:
+            # a stream only succeeds once its last chunk arrived, errors part way still reach the breaker
+            return TimedStream(response, finish)
+        finish()
+        return response
+
+    async def async_generate(
+        self,
+        contents: Any,
+        model_name: str = None,
+        system: str = None,
+        tools: Dict[str, Union[Callable, Awaitable]] = None,
+        stream: bool = False,
+        budget: float = None,
+        ) -> Tuple[str, Any]:
+        # returns the model that answered with its response, a hedged request may be answered by the hedge model
+        model_name = model_name or self.model_name
+        generate = partial(self.async_hedged_generate, contents, model_name, system, tools, stream, budget)
+        if stream:
+            return await generate() # a stream can only be consumed once, so it is never shared
+        key = request_key(contents, model_name, system, tuple(tools.keys()) if tools else ())
+        return await self.scheduler.coalesce(key, generate)
+
+    async def async_hedged_generate(
+        self,
+        contents: Any,
+        model_name: str,
+        system: str = None,
+        tools: Dict[str, Union[Callable, Awaitable]] = None,
+        stream: bool = False,
+        budget: float = None,
+        ) -> Tuple[str, Any]:
+        # the primary model gets a latency budget, after that a hedged request races it on a faster model
+        budget = self.config.latency_budget if budget is None else budget
+        hedge_model = self.config.hedge_model
+        if not budget or not hedge_model or hedge_model == model_name:
+            return model_name, await self.async_timed_generate(contents, model_name, system, tools, stream)
+        primary = asyncio.create_task(self.async_timed_generate(contents, model_name, system, tools, stream))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=budget)
+            if done:
+                self.routes["primary"] += 1
+                return model_name, primary.result()
+            log.info(f"⏱️ {model_name} over {budget}s budget, hedging with {hedge_model}")
+            hedge = asyncio.create_task(self.async_timed_generate(contents, hedge_model, system, tools, stream))
+            pending.add(hedge)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        log.warning(f"⏱️ {'hedged' if task is hedge else 'primary'} request failed: {str(error)}")
+                        continue
+                    route = "hedge" if task is hedge else "primary_after_hedge"
+                    self.routes[route] += 1
+                    log.debug(f"⏱️ route={route}")
+                    return hedge_model if task is hedge else model_name, task.result()
+            raise error
+        finally:
+            # the losing request, or both if the caller was cancelled
+            for task in pending:
+                task.cancel()
+
+    async def async_ping(self) -> float:
+        # a cheap count_tokens request on the generation channel, the first one pays connection setup
+        cold = not self.connected
+        start = time.time()
+        try:
+            await self.cached_model(self.model_name).count_tokens_async("ping")
+        except Exception:
+            self.connected = False
+            raise
+        elapsed = time.time() - start
+        self.connected = True
+        self.last_request = time.monotonic()
+        self.latency.record("ping_cold" if cold else "ping_warm", elapsed)
+        log.debug(f"🏓 {'cold' if cold else 'warm'} ping took ⏳ {elapsed * 1000:.2f}ms")
+        return elapsed
+
+    def connection_setup(self) -> Optional[float]:
+        # estimated connection setup cost, cold minus warm median ping time
+        cold, warm = self.latency.percentile("ping_cold", 0.5), self.latency.percentile("ping_warm", 0.5)
+        return None if cold is None or warm is None else cold - warm
+
+    async def async_keepalive(self):
+        interval = self.config.keepalive_interval
+        while True:
+            idle = time.monotonic() - self.last_request
+            if idle >= interval:
+                try:
+                    await self.async_ping()
+                except Exception as e:
+                    log.debug(f"🏓 keepalive ping failed: {str(e)}")
+                idle = 0.0
+            await asyncio.sleep(interval - idle)
+
+    async def async_start_keepalive(self):
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.get_running_loop()
+        if self.config.keepalive_interval is None:
+            return
+        if self.keepalive_task is None or self.keepalive_task.done():
+            self.keepalive_task = asyncio.create_task(self.async_keepalive())
+
+    def warm(self, *args: Any):
+        # safe to call from any thread, e.g. when a capture starts
+        if self.loop is None or self.loop.is_closed() or time.monotonic() - self.last_request < self.config.warm_min_idle:
+            return
+        log.debug("🏓 warming connection")
+        asyncio.run_coroutine_threadsafe(self.async_ping(), self.loop)
+
+    def begin_turn(self) -> int:
+        return self.ledger.begin_turn()
+
+    def account(self, entry_point: str, model_name: str, response: Any, media: List[Any], start: float):
+        usage = getattr(response, 'usage_metadata', None)
+        self.ledger.record(LedgerEntry(
+            entry_point=entry_point,
+            model=model_name,
+            prompt_tokens=usage.prompt_token_count if usage else 0,
+            output_tokens=usage.candidates_token_count if usage else 0,
+            media_bytes=sum(media_bytes(m) for m in media),
+            wall_time=time.time() - start,
+            turn=self.ledger.turn,
+            timestamp=start,
+        ))
+
+    async def account_calls(self, entry_point: str, model_name: str, response: Any, stream: bool, media: List[Any], start: float) -> AsyncIterator[Any]:
+        # usage is only complete once a streamed response is exhausted, tools are still running then
+        async for fn in response_calls(response, stream):
+            yield fn
+        self.account(entry_point, model_name, response, media, start)
+
+    async def async_fit_budget(self, prompt: str, media: List[Any]) -> Tuple[str, List[Any]]:
+        # keeps a request inside what is left of the per-turn token budget
+        budget = self.config.turn_token_budget
+        if not budget:
+            return prompt, media
+        remaining = budget - self.ledger.turn_tokens()
+        if len(prompt) // 4 + MEDIA_TOKENS * len(media) <= remaining:
+            return prompt, media
+        log.warning(f"🧾 turn {self.ledger.turn} over token budget, {remaining} of {budget} left")
+        media = [await asyncio.to_thread(downsize_image, m, self.config.budget_image_max_side) for m in media]
+        max_chars = max(self.config.budget_min_prompt_chars, (remaining - MEDIA_TOKENS * len(media)) * 4)
+        return prompt[:max_chars], media
+
     async def async_file_api(
         self,
         file_path: str,
         display_name: Optional[str] = None,
         max_retries: int = None,
         retry_delay: float = None,
+        deadline: float = None,
         ) -> file_types.File:
         max_retries = max_retries or self.config.file_api_max_retries
+        polls = range(max_retries) if max_retries else itertools.count()
         retry_delay = retry_delay or self.config.file_api_retry_delay
+        deadline = deadline or self.config.file_api_deadline
+        loop = asyncio.get_running_loop()
         try:
             assert os.path.exists(file_path), f"file not found: {file_path}"
             display_name = display_name or file_path
-            file = genai.upload_file(path=file_path, display_name=display_name)
+            key = await asyncio.to_thread(FileCache.key, file_path)
+            if file := self.file_cache.get(key):
+                log.debug(f"💾 reusing cached file {file.display_name} at {file.uri}")
+                return file
+            # the sdk calls block, so they run on the upload executor to keep the loop free
+            end_time = loop.time() + deadline
+            file = await loop.run_in_executor(self.upload_executor, partial(self.backend.upload_file, path=file_path, display_name=display_name))
             log.debug(f"💾 uploading file {file.display_name} to {file.uri}")
-            for retry in range(max_retries):
+            limit = f"{max_retries} retries"
+            for retry in polls:
                 if file.state == genai.protos.File.State.ACTIVE:
                     break
                 elif file.state == genai.protos.File.State.FAILED:
                     raise ValueError(f"file processing failed: {file.state.name}")
-                elif file.state == genai.protos.File.State.PROCESSING:
-                    log.debug(f"💾 waiting on file processing, retry {retry+1} of {max_retries}")
-                    await asyncio.sleep(retry_delay * 2 ** retry) # exponential backoff
+                remaining = end_time - loop.time()
+                if remaining <= 0:
+                    limit = f"the {deadline}s deadline"
+                    break
+                log.debug(f"💾 waiting on file processing, retry {retry+1} of {max_retries or 'unlimited'}, {remaining:.1f}s left")
+                # exponential backoff, capped and clipped to the deadline
+                await asyncio.sleep(min(retry_delay * 2 ** retry, self.config.file_api_max_retry_delay, remaining))
+                file = await loop.run_in_executor(self.upload_executor, self.backend.get_file, file.name)
+            if file.state != genai.protos.File.State.ACTIVE:
+                raise TimeoutError(f"file {file.name} still {file.state.name} after {limit} ({deadline - (end_time - loop.time()):.1f}s)")
             log.debug(f"💾 file uploaded {display_name}")
+            self.file_cache.put(key, file)
             return file
         except Exception as e:
             log.warning(f"💾 error with file_api: {str(e)}")
             return None
 
-    async def async_process_audio(self, audio_path: str, prompt: str = None, model_name: str = None) -> str:
-        prompt = prompt or self.config.default_audio_prompt
+    @staticmethod
+    def media_signature(media_path: str) -> Tuple[int, int]:
+        stat = os.stat(media_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    async def async_load_media(self, media_path: str) -> Union[Dict[str, Any], file_types.File]:
+        # small media goes inline as a blob, large media goes through the file api
+        start = time.time()
+        size = os.path.getsize(media_path)
+        if size <= self.config.inline_max_bytes:
+            mime_type, _ = mimetypes.guess_type(media_path)
+            data = await asyncio.to_thread(_read_bytes, media_path)
+            media = {"mime_type": mime_type, "data": data}
+            transport = "inline"
+        else:
+            media = await self.async_file_api(media_path)
+            transport = "file_api"
+        log.debug(f"📦 {transport} {size}B took ⏳ {(time.time() - start) * 1000:.2f}ms [{media_path}]")
+        return media
+
+    def prefetch(self, media_path: str):
+        # safe to call from any thread, starts loading a fresh capture before anyone asks for it
+        if not self.config.speculative_upload or self.loop is None or self.loop.is_closed():
+            return
+        if not os.path.exists(media_path):
+            return
+        signature = self.media_signature(media_path)
+        if (stale := self.prefetches.get(media_path)) is not None:
+            # the capture overwrote the file the previous load was reading
+            stale[1].cancel()
+        log.debug(f"📦 prefetching [{media_path}]")
+        self.prefetches[media_path] = (signature, asyncio.run_coroutine_threadsafe(self.async_load_media(media_path), self.loop))
+
+    async def async_media(self, media_path: str) -> Union[Dict[str, Any], file_types.File]:
+        if self.breaker.blocked():
+            raise CircuitOpenError(f"gemini unavailable, circuit {self.breaker.state}")
+        if (prefetch := self.prefetches.get(media_path)) is not None:
+            signature, future = prefetch
+            if signature == self.media_signature(media_path) and not future.cancelled():
+                try:
+                    if (media := await asyncio.shield(asyncio.wrap_future(future))) is not None:
+                        log.debug(f"📦 using prefetched [{media_path}]")
+                        return media
+                except asyncio.CancelledError:
+                    # a recapture cancels the prefetch this turn was waiting on, only a cancelled turn stops here
+                    if not future.cancelled() or asyncio.current_task().cancelling():
+                        raise
+                    log.debug(f"📦 prefetch cancelled [{media_path}]")
+                except Exception as e:
+                    log.debug(f"📦 prefetch failed [{media_path}]: {str(e)}")
+            else:
+                future.cancel()
+                del self.prefetches[media_path]
+        return await self.async_load_media(media_path)
+
+    async def async_memo_key(self, media_paths: List[str], *extra: Any) -> Optional[str]:
+        # content hashes rather than paths or upload uris, so recaptures of an unchanged scene still hit
+        if not self.config.use_memo or memo_bypass.get():
+            return None
+        media_keys = [await asyncio.to_thread(FileCache.key, path) for path in media_paths]
+        return request_key(media_keys, *extra)
+
+    async def async_process_media(self, kind: str, media_path: str, prompt: str = None, model_name: str = None) -> str:
+        # kind is audio, image or video, it picks the default prompt and names the ledger entry
+        prompt = prompt or getattr(self.config, f"default_{kind}_prompt")
         model_name = model_name or self.model_name
-        log.info("🎙️ audio")
-        log.debug(f"🎙️\n\tmodel={model_name}\n\tprompt={prompt}")
-        model = genai.GenerativeModel(model_name=model_name)
-        audio = await self.async_file_api(audio_path)
-        response = await model.generate_content_async([audio, prompt])
-        log.debug(f"🎙️ response={response}")
+        emoji = MEDIA_EMOJIS[kind]
+        log.info(f"{emoji} {kind}")
+        log.debug(f"{emoji}\n\tmodel={model_name}\n\tprompt={prompt}")
+        start = time.time()
+        memo_key = await self.async_memo_key([media_path], "process", prompt, model_name)
+        if memo_key and (text := await self.memo.async_get(memo_key)) is not None:
+            log.info("💽 memo hit")
+            return text
+        media = await self.async_media(media_path)
+        prompt, (media,) = await self.async_fit_budget(prompt, [media])
+        answered_by, response = await self.async_generate([media, prompt], model_name)
+        log.debug(f"{emoji} response={response}")
+        self.account(f"process_{kind}", answered_by, response, [media], start)
+        if memo_key and answered_by == model_name:
+            await self.memo.async_put(memo_key, response.text)
         return response.text
 
+    async def async_process_audio(self, audio_path: str, prompt: str = None, model_name: str = None) -> str:
+        return await self.async_process_media("audio", audio_path, prompt, model_name)
+
     async def async_process_image(self, image_path: str, prompt: str = None, model_name: str = None) -> str:
-        prompt = prompt or self.config.default_image_prompt
-        model_name = model_name or self.model_name
-        log.info("📷 image")
-        log.debug(f"📷\n\tmodel={model_name}\n\tprompt={prompt}")
-        model = genai.GenerativeModel(model_name=model_name)
-        image = await self.async_file_api(image_path)
-        response = await model.generate_content_async([image, prompt])
-        log.debug(f"📷 response={response}")
-        return response.text
+        return await self.async_process_media("image", image_path, prompt, model_name)
 
     async def async_process_video(self, video_path: str, prompt: str = None, model_name: str = None) -> str:
-        prompt = prompt or self.config.default_video_prompt
+        return await self.async_process_media("video", video_path, prompt, model_name)
+
+    async def async_stream_media(self, media_path: str, prompt: str, model_name: str = None) -> AsyncIterator[str]:
+        # yields text as it is generated so callers can act on partial descriptions
         model_name = model_name or self.model_name
-        log.info("📹 video")
-        log.debug(f"📹\n\tmodel={model_name}\n\tprompt={prompt}")
-        model = genai.GenerativeModel(model_name=model_name)
-        video = await self.async_file_api(video_path)
-        response = await model.generate_content_async([video, prompt])
-        log.debug(f"📹 response={response}")
-        return response.text
+        log.info("🌊 stream")
+        log.debug(f"🌊\n\tmodel={model_name}\n\tprompt={prompt}\n\tmedia={media_path}")
+        start = time.time()
+        media = await self.async_media(media_path)
+        prompt, (media,) = await self.async_fit_budget(prompt, [media])
+        answered_by, response = await self.async_generate([media, prompt], model_name, stream=True)
+        async for chunk in response:
+            log.debug(f"🌊 chunk={chunk.text}")
+            yield chunk.text
+        self.account("stream_media", answered_by, response, [media], start)
     
-    async def async_use_tool(self, tools: Dict[str, Union[Callable, Awaitable]], prompt: str, system: str = None, model_name: str = None) -> str:
+    async def async_use_tool(
+        self,
+        tools: Dict[str, Union[Callable, Awaitable]],
+        prompt: str,
+        system: str = None,
+        model_name: str = None,
+        stream: bool = None,
+        ) -> List[ToolResult]:
         model_name = model_name or self.model_name
         system = system or self.config.default_tool_system
+        stream = self.config.stream_tools if stream is None else stream
         log.info("🧰 tool")
         log.debug(f"🧰\n\tmodel={model_name}\n\tsystem={system}\n\tprompt={prompt}")
-        model = genai.GenerativeModel(
-            model_name=model_name,
-            tools=tools.values(),
-            system_instruction=system,
-            # https://ai.google.dev/gemini-api/docs/function-calling#function_calling_mode
-            tool_config={"function_calling_config": {
-                "mode": "ANY",
-                "allowed_function_names": tools.keys(),
-            }},
-        )
-        chat = model.start_chat()
-        response = await chat.send_message_async(prompt)
-        log.debug(f"🧰 response={response}")
-        tool_output = "❓"
-        for part in response.parts:
-            if fn := part.function_call:
-                args = ", ".join(f"{key}={val}" for key, val in fn.args.items())
-                log.debug(f"🧰 calling {fn.name}({args})")
-                if fn.name in tools:
-                    if inspect.iscoroutinefunction(tools[fn.name]):
-                        tool_output = await tools[fn.name](**fn.args)
-                    else:
-                        tool_output = tools[fn.name](**fn.args)
-                else:
-                    log.warning(f"🧰 unknown tool: {fn.name}")
-        return tool_output
\ No newline at end of file
+        memo_key = await self.async_memo_key([], "use_tool", prompt, system, model_name, tuple(tools.keys()))
+        if memo_key and (calls := await self.memo.async_get(memo_key)) is not None:
+            log.info("💽 memo hit")
+            return await self.async_call_tools(tools, list_calls([ToolCall(**call) for call in calls]))
+        if self.config.use_intents and (calls := self.intent_cache.match(prompt, tools)):
+            log.info("🧭 local intent")
+            return await self.async_call_tools(tools, list_calls(calls))
+        start = time.time()
+        prompt, _ = await self.async_fit_budget(prompt, [])
+        try:
+            answered_by, response = await self.async_generate(prompt, model_name, system, tools, stream=stream)
+        except Exception as e:
+            if not self.config.degraded_fallback:
+                raise
+            return await self.async_fallback(tools, e)
+        calls = self.account_calls("use_tool", answered_by, response, stream, [], start)
+        # a hedge model's decision is not memoized under the primary model's key
+        memo_key = memo_key if answered_by == model_name else None
+        try:
+            return await self.async_call_tools(tools, calls, description=prompt, memo_key=memo_key)
+        except Exception as e:
+            # a stream that failed before its first call
+            if not self.config.degraded_fallback:
+                raise
+            return await self.async_fallback(tools, e)
+
+    async def async_perceive_and_act(
+        self,
+        tools: Dict[str, Union[Callable, Awaitable]],
+        media_path: Union[str, List[str]],
+        prompt: str,
+        system: str = None,
+        model_name: str = None,
+        stream: bool = None,
+        ) -> List[ToolResult]:
+        # single round trip: media, prompt, and tool declarations go out in one request
+        # several media paths (e.g. an image and an audio clip) are fused into the same request
+        media_paths = [media_path] if isinstance(media_path, str) else list(media_path)
+        model_name = model_name or self.model_name
+        system = system or self.config.default_tool_system
+        stream = self.config.stream_tools if stream is None else stream
+        log.info("🎯 perceive and act")
+        log.debug(f"🎯\n\tmodel={model_name}\n\tsystem={system}\n\tprompt={prompt}\n\tmedia={media_paths}")
+        memo_key = await self.async_memo_key(media_paths, "perceive_and_act", prompt, system, model_name, tuple(tools.keys()))
+        if memo_key and (calls := await self.memo.async_get(memo_key)) is not None:
+            log.info("💽 memo hit")
+            return await self.async_call_tools(tools, list_calls([ToolCall(**call) for call in calls]))
+        start = time.time()
+        try:
+            media = list(await asyncio.gather(*(self.async_media(path) for path in media_paths)))
+            prompt, media = await self.async_fit_budget(prompt, media)
+            answered_by, response = await self.async_generate([*media, prompt], model_name, system, tools, stream=stream)
+        except Exception as e:
+            if not self.config.degraded_fallback:
+                raise
+            return await self.async_fallback(tools, e)
+        calls = self.account_calls("perceive_and_act", answered_by, response, stream, media, start)
+        memo_key = memo_key if answered_by == model_name else None
+        try:
+            return await self.async_call_tools(tools, calls, memo_key=memo_key)
+        except Exception as e:
+            if not self.config.degraded_fallback:
+                raise
+            return await self.async_fallback(tools, e)
+
+    async def async_fallback(self, tools: Dict[str, Union[Callable, Awaitable]], error: Exception = None) -> List[ToolResult]:
+        # degraded mode: replay the most recent cached decision, or a random tool, each tool plays its own clip
+        log.warning(f"🔌 degraded mode, local tool instead of gemini: {str(error)}")
+        calls = self.intent_cache.recent(tools) or [ToolCall(name=random.choice(list(tools.keys())), args={})]
+        results = await self.async_call_tools(tools, list_calls(calls))
+        for result in results:
+            result.degraded = True
+        return results
+
+    async def async_call_tool(self, tools: Dict[str, Union[Callable, Awaitable]], fn: Any) -> Any:
+        args = ", ".join(f"{key}={val}" for key, val in fn.args.items())
+        log.debug(f"🧰 calling {fn.name}({args})")
+        if fn.name not in tools:
+            log.warning(f"🧰 unknown tool: {fn.name}")
+            return None
+        if inspect.iscoroutinefunction(tools[fn.name]):
+            return await tools[fn.name](**fn.args)
+        return tools[fn.name](**fn.args)
+
+    async def async_memo_decision(self, memo_key: Optional[str], results: List[ToolResult]):
+        # the model's decision is memoized, tools run again on a hit
+        if memo_key and results:
+            await self.memo.async_put(memo_key, [{"name": result.name, "args": result.args} for result in results])
+
+    def learn_intent(self, description: Optional[str], calls: List[Any]):
+        if description and self.config.use_intents:
+            self.intent_cache.add(description, [ToolCall(name=fn.name, args=dict(fn.args)) for fn in calls])
+
+    async def async_run_tool(
+        self,
+        tools: Dict[str, Union[Callable, Awaitable]],
+        fn: Any,
+        result: ToolResult,
+        before: List[asyncio.Task],
+        start: float,
+        ):
+        if before:
+            await asyncio.wait(before)
+        result.start = time.time() - start
+        try:
+            result.output = await self.async_call_tool(tools, fn)
+        except Exception as e:
+            # a failing tool should not cancel the others
+            log.warning(f"🧰 error in tool {fn.name}: {str(e)}")
+            result.error = str(e)
+        result.elapsed = time.time() - start - result.start
+
+    async def async_call_tools(
+        self,
+        tools: Dict[str, Union[Callable, Awaitable]],
+        calls: AsyncIterator[Any],
+        description: str = None,
+        memo_key: str = None,
+        ) -> List[ToolResult]:
+        # every call is dispatched concurrently as soon as it arrives, a tool listed in
+        # config.tool_order waits for the tools it must follow that were already dispatched
+        start = time.time()
+        results: List[ToolResult] = []
+        tasks: Dict[str, List[asyncio.Task]] = {}
+        seen: List[Any] = []
+        error: Optional[Exception] = None
+        async with asyncio.TaskGroup() as tg:
+            try:
+                async for fn in calls:
+                    seen.append(fn)
+                    before = [task for name in self.config.tool_order.get(fn.name, ()) for task in tasks.get(name, [])]
+                    result = ToolResult(name=fn.name, args=dict(fn.args))
+                    results.append(result)
+                    tasks.setdefault(fn.name, []).append(tg.create_task(self.async_run_tool(tools, fn, result, before, start)))
+            except Exception as e:
+                # a stream that breaks mid-response, the tools already dispatched still finish
+                error = e
+        log.debug(f"🧰 results={results}")
+        if error is not None:
+            if not results:
+                raise error
+            log.warning(f"🌊 stream failed after {len(results)} calls, keeping them: {str(error)}")
+            return results
+        # only a complete decision is learned and memoized
+        self.learn_intent(description, seen)
+        await self.async_memo_decision(memo_key, results)
+        return results
\ No newline at end of file
@@ -0,0 +1,231 @@
+from dataclasses import dataclass, field
+import asyncio
+import datetime
+import itertools
+import logging
+import math
+import mimetypes
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from google.api_core import exceptions
+import google.generativeai as genai
+from google.generativeai.types import content_types, file_types, generation_types
+
+from simon.gemini import GeminiBackend
+from simon.utils import BaseConfig
+
+log = logging.getLogger('gemini')
+
+# ---- Fake Gemini
+# local stand-in for the Gemini api, used for offline tests and benchmarks
+# responses are real sdk response objects so the code under test runs unchanged
+# ----
+
+# a scripted response is either text or a list of (function name, args) calls
+ScriptedResponse = Union[str, List[Tuple[str, Dict[str, Any]]]]
+
+@dataclass(kw_only=True)
+class FakeGeminiConfig(BaseConfig):
+    name: str = "fake"
+    emoji: str = "🧪"
+    seed: Optional[int] = 0
+    # latency of each operation as (median seconds, lognormal sigma)
+    latency: Dict[str, Tuple[float, float]] = field(default_factory=lambda: {
+        "upload": (0.3, 0.3),
+        "get_file": (0.05, 0.3),
+        "generate": (1.5, 0.4),
+        "stream_chunk": (0.1, 0.3),
+        "cache": (0.2, 0.3),
+        "count_tokens": (0.05, 0.3),
+        "connect": (0.4, 0.3),
+    })
+    # generate latency overrides for models whose name contains the key
+    model_latency: Dict[str, Tuple[float, float]] = field(default_factory=lambda: {
+        "flash": (0.6, 0.3),
+    })
+    # probability that an operation raises ServiceUnavailable
+    failure_rate: Dict[str, float] = field(default_factory=dict)
+    # get_file polls before an uploaded file becomes ACTIVE
+    processing_polls: int = 1
+    # the channel drops after this long without traffic and the next request pays "connect" latency
+    connection_idle_timeout: float = 60.0
+    # responses returned in order before falling back to the default behavior
+    script: List[ScriptedResponse] = field(default_factory=list)
+    default_text: str = "a person with both arms raised"
+    stream_chunks: int = 3
+
+class FakeModel:
+
+    def __init__(self, backend: 'FakeGeminiBackend', model_name: str, tools: Optional[content_types.FunctionLibrary] = None):
+        self.backend = backend
+        self.model_name = model_name
+        self.tools = tools
+
+    async def generate_content_async(self, contents: Any, stream: bool = False) -> generation_types.AsyncGenerateContentResponse:
+        latency = self.backend.config.latency["generate"]
+        for key, model_latency in self.backend.config.model_latency.items():
+            if key in self.model_name:
+                latency = model_latency
+        await self.backend.async_connect()
+        await asyncio.sleep(self.backend.sample(latency))
+        self.backend.maybe_fail("generate")
+        prompt = " ".join(part.text for content in content_types.to_contents(contents) for part in content.parts if part.text)
+        proto = self.backend.respond(prompt, contents, self.tools)
+        self.backend.requests.append({"model": self.model_name, "prompt": prompt, "stream": stream})
+        if not stream:
+            return generation_types.AsyncGenerateContentResponse.from_response(proto)
+        return await generation_types.AsyncGenerateContentResponse.from_aiterator(self.chunks(proto))
+
+    async def count_tokens_async(self, contents: Any) -> genai.protos.CountTokensResponse:
+        await self.backend.async_connect()
+        await asyncio.sleep(self.backend.sample(self.backend.config.latency["count_tokens"]))
+        self.backend.maybe_fail("count_tokens")
+        text = " ".join(part.text for content in content_types.to_contents(contents) for part in content.parts)
+        return genai.protos.CountTokensResponse(total_tokens=len(text) // 4)
+
+    async def chunks(self, proto: genai.protos.GenerateContentResponse):
+        parts = list(proto.candidates[0].content.parts)
+        if len(parts) == 1 and parts[0].text:
+            # split text across chunks like a real stream
+            words = parts[0].text.split(" ")
+            size = math.ceil(len(words) / self.backend.config.stream_chunks)
+            parts = [genai.protos.Part(text=" ".join(words[i:i + size]) + " ") for i in range(0, len(words), size)]
+        for i, part in enumerate(parts):
+            if i > 0:
+                await asyncio.sleep(self.backend.sample(self.backend.config.latency["stream_chunk"]))
+                self.backend.maybe_fail("stream_chunk")
+            yield genai.protos.GenerateContentResponse(
+                candidates=[genai.protos.Candidate(content=genai.protos.Content(role="model", parts=[part]))],
+                usage_metadata=proto.usage_metadata,
+            )
+
+class FakeCachedContent:
+
+    def __init__(self, backend: 'FakeGeminiBackend', name: str, model: str, tools: content_types.FunctionLibrary, ttl: datetime.timedelta):
+        self.backend = backend
+        self.name = name
+        self.model = model
+        self.tools = tools
+        self.expire_time = datetime.datetime.now(datetime.timezone.utc) + ttl
+
+    def update(self, ttl: datetime.timedelta):
+        time.sleep(self.backend.sample(self.backend.config.latency["cache"]))
+        self.backend.maybe_fail("cache")
+        self.expire_time = datetime.datetime.now(datetime.timezone.utc) + ttl
+
+class FakeGeminiBackend(GeminiBackend):
+
+    def __init__(self, config: FakeGeminiConfig = None):
+        self.config: FakeGeminiConfig = config or FakeGeminiConfig()
+        self.random = random.Random(self.config.seed)
+        self.script: List[ScriptedResponse] = list(self.config.script)
+        self.files: Dict[str, Tuple[genai.protos.File, int]] = {}
+        self.ids = itertools.count()
+        self.last_traffic: Optional[float] = None
+        # every generate request, for assertions in tests
+        self.requests: List[Dict[str, Any]] = []
+
+    def sample(self, latency: Tuple[float, float]) -> float:
+        median, sigma = latency
+        return median * math.exp(self.random.gauss(0, sigma))
+
+    async def async_connect(self):
+        now = time.monotonic()
+        if self.last_traffic is None or now - self.last_traffic > self.config.connection_idle_timeout:
+            await asyncio.sleep(self.sample(self.config.latency["connect"]))
+        self.last_traffic = time.monotonic()
+
+    def maybe_fail(self, operation: str):
+        if self.random.random() < self.config.failure_rate.get(operation, 0.0):
+            raise exceptions.ServiceUnavailable(f"fake {operation} failure")
+
+    def respond(self, prompt: str, contents: Any, tools: Optional[content_types.FunctionLibrary]) -> genai.protos.GenerateContentResponse:
+        if self.script:
+            scripted = self.script.pop(0)
+        elif tools is not None:
+            # pick the declared tool whose name shares the most words with the prompt
+            names = [declaration.name for tool in tools.to_proto() for declaration in tool.function_declarations]
+            words = set(re.findall(r"[a-z0-9]+", prompt.lower()))
+            scripted = [(max(names, key=lambda name: (len(words & set(name.split("_"))), -names.index(name))), {})]
+        else:
+            scripted = self.config.default_text
+        if isinstance(scripted, str):
+            parts = [genai.protos.Part(text=scripted)]
+            output_tokens = len(scripted) // 4
+        else:
+            parts = [genai.protos.Part(function_call=genai.protos.FunctionCall(name=name, args=args)) for name, args in scripted]
+            output_tokens = 8 * len(parts)
+        media = sum(1 for content in content_types.to_contents(contents) for part in content.parts if not part.text)
+        prompt_tokens = len(prompt) // 4 + 258 * media
+        return genai.protos.GenerateContentResponse(
+            candidates=[genai.protos.Candidate(
+                content=genai.protos.Content(role="model", parts=parts),
+                finish_reason=genai.protos.Candidate.FinishReason.STOP,
+            )],
+            usage_metadata=genai.protos.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
+
+    def configure(self, api_key: Optional[str]):
+        log.info(f"{self.config.emoji} using fake gemini backend")
+
+    def get_model(self, model_name: str) -> Any:
+        return f"fake model {model_name}"
+
+    def upload_file(self, path: str, display_name: str = None) -> file_types.File:
+        time.sleep(self.sample(self.config.latency["upload"]))
+        self.maybe_fail("upload")
+        name = f"files/fake-{next(self.ids)}"
+        proto = genai.protos.File(
+            name=name,
+            display_name=display_name or os.path.basename(path),
+            mime_type=mimetypes.guess_type(path)[0],
+            size_bytes=os.path.getsize(path),
+            uri=f"https://fake.local/{name}",
+            state=genai.protos.File.State.PROCESSING if self.config.processing_polls else genai.protos.File.State.ACTIVE,
+            expiration_time=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=48),
+        )
+        self.files[name] = (proto, 0)
+        return file_types.File(proto)
+
+    def get_file(self, name: str) -> file_types.File:
+        time.sleep(self.sample(self.config.latency["get_file"]))
+        self.maybe_fail("get_file")
+        proto, polls = self.files[name]
+        polls += 1
+        if polls >= self.config.processing_polls:
+            proto.state = genai.protos.File.State.ACTIVE
+        self.files[name] = (proto, polls)
+        return file_types.File(proto)
+
+    def generative_model(
+        self,
+        model_name: str,
+        system_instruction: str = None,
+        tools: content_types.FunctionLibrary = None,
+        tool_config: Dict[str, Any] = None,
+        ) -> FakeModel:
+        return FakeModel(self, model_name, tools)
+
+    def create_cached_content(
+        self,
+        model: str,
+        display_name: str,
+        system_instruction: str,
+        tools: content_types.FunctionLibrary,
+        tool_config: Dict[str, Any],
+        ttl: datetime.timedelta,
+        ) -> FakeCachedContent:
+        time.sleep(self.sample(self.config.latency["cache"]))
+        self.maybe_fail("cache")
+        return FakeCachedContent(self, f"cachedContents/fake-{next(self.ids)}", model, tools, ttl)
+
+    def model_from_cached_content(self, cached_content: FakeCachedContent) -> FakeModel:
+        return FakeModel(self, cached_content.model, cached_content.tools)
@@ -0,0 +1,128 @@
+""" Run Gemini over an archive of captured media for evaluation and prompt tuning.
+
+> python -m simon.scripts.batch_gemini simon/image -o results.jsonl
+> python -m simon.scripts.batch_gemini manifest.jsonl -o results.jsonl --tools app-simon-says.py
+
+A manifest is a jsonl file with one {"path": ..., "prompt": ...} object per line, prompt is optional.
+Finished paths are appended to a checkpoint file so an interrupted run resumes where it stopped.
+"""
+import argparse
+import asyncio
+from dataclasses import fields
+import json
+import logging
+import mimetypes
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from simon.gemini import Gemini, GeminiConfig, PRIORITY_BATCH, request_priority
+from simon.scripts.common import load_tools, percentile
+
+parser = argparse.ArgumentParser(description="Batch process captured media with Gemini")
+parser.add_argument("source", help="Directory of media files or jsonl manifest")
+parser.add_argument("-o", "--output", default="batch_results.jsonl", help="Results jsonl, appended as items finish")
+parser.add_argument("--checkpoint", default=None, help="Checkpoint file, defaults to <output>.ckpt")
+parser.add_argument("-c", "--concurrency", type=int, default=4, help="Maximum items in flight")
+parser.add_argument("-m", "--model", default=next(f.default for f in fields(GeminiConfig) if f.name == "default_model"), help="Gemini model to use")
+parser.add_argument("-p", "--prompt", default=None, help="Prompt for every item, overrides the default prompts")
+parser.add_argument("--tools", default=None, help="Python file with a tools section, runs async_use_tool on each description")
+parser.add_argument("--intents", action="store_true", help="Allow the local intent cache to answer tool selection")
+parser.add_argument("--no-memo", action="store_true", help="Always call the model instead of replaying memoized responses")
+parser.add_argument("--fake", action="store_true", help="Use the local fake backend instead of the Gemini api")
+parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+args = parser.parse_args()
+
+logging.basicConfig(format='|%(relativeCreated)d|%(message)s')
+logging.getLogger('gemini').setLevel(logging.DEBUG if args.debug else logging.INFO)
+log = logging.getLogger('batch')
+log.setLevel(logging.INFO)
+
+def load_items(source: str) -> List[Dict[str, str]]:
+    if os.path.isdir(source):
+        items = []
+        for root, _, files in os.walk(source):
+            for file_name in sorted(files):
+                mime_type, _ = mimetypes.guess_type(file_name)
+                if mime_type and mime_type.split('/')[0] in ('image', 'audio', 'video'):
+                    items.append({"path": os.path.join(root, file_name)})
+        return items
+    with open(source) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+async def process(gemini: Gemini, item: Dict[str, str], tools: Dict[str, Callable]) -> Dict[str, Any]:
+    request_priority.set(PRIORITY_BATCH)
+    path, prompt = item['path'], item.get('prompt', args.prompt)
+    kind = (mimetypes.guess_type(path)[0] or '').split('/')[0]
+    result: Dict[str, Any] = {"path": path, "kind": kind, "model": args.model}
+    start = time.time()
+    try:
+        process_media = {
+            'image': gemini.async_process_image,
+            'audio': gemini.async_process_audio,
+            'video': gemini.async_process_video,
+        }[kind]
+        result['description'] = await process_media(path, prompt)
+        if tools:
+            result['tools'] = [tool.name for tool in await gemini.async_use_tool(tools, result['description'])]
+    except Exception as e:
+        result['error'] = str(e)
+    result['latency'] = time.time() - start
+    return result
+
+async def main():
+    checkpoint = args.checkpoint or f"{args.output}.ckpt"
+    done = set()
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            done = {line.strip() for line in f if line.strip()}
+    items = [item for item in load_items(args.source) if item['path'] not in done]
+    log.info(f"📦 {len(items)} items to process, {len(done)} already done")
+    tools = load_tools(args.tools) if args.tools else {}
+    backend = None
+    if args.fake:
+        from simon.gemini_fake import FakeGeminiBackend
+        backend = FakeGeminiBackend()
+    # degraded fallback is off so a random local tool is never recorded as the model's choice
+    # and hedging is off so every result comes from the requested model, batch runs have no latency budget
+    gemini = Gemini(GeminiConfig(
+        name="batch",
+        default_model=args.model,
+        use_intents=args.intents,
+        use_memo=not args.no_memo,
+        degraded_fallback=False,
+        latency_budget=None,
+    ), backend=backend)
+    if tools:
+        gemini.register_tools(tools)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    errors = 0
+    start = time.time()
+
+    async def run(item: Dict[str, str]):
+        nonlocal errors
+        async with semaphore:
+            result = await process(gemini, item, tools)
+        # results are written as they finish, only successes are checkpointed so failures retry on resume
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+        if 'error' in result:
+            errors += 1
+            log.warning(f"❌ {item['path']}: {result['error']}")
+        else:
+            with open(checkpoint, 'a') as f:
+                f.write(f"{item['path']}\n")
+            latencies.append(result['latency'])
+            log.info(f"✅ {item['path']} {result['latency']:.2f}s")
+
+    async with asyncio.TaskGroup() as tg:
+        for item in items:
+            tg.create_task(run(item))
+    elapsed = time.time() - start
+    log.info(f"📊 {len(items)} items in {elapsed:.2f}s ({len(items) / max(elapsed, 1e-9):.2f} items/s), {errors} errors")
+    log.info(f"📊 latency p50={percentile(latencies, 0.50):.2f}s p95={percentile(latencies, 0.95):.2f}s p99={percentile(latencies, 0.99):.2f}s")
+    log.info(f"📊 models {gemini.latency.summary()}")
+    log.info(f"📊 memo {gemini.memo.stats()}")
+
+asyncio.run(main())
@@ -0,0 +1,76 @@
+""" Benchmark the Simon says pipeline offline against the fake Gemini backend.
+
+> python -m simon.scripts.bench_gemini -n 50
+> python -m simon.scripts.bench_gemini -n 50 --media docs/assets/thumbnail.png --failure-rate 0.05
+
+Runs the describe-then-act and perceive-and-act paths with stand-in tools and reports latency percentiles.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, List
+
+from simon.gemini import Gemini, GeminiConfig
+from simon.gemini_fake import FakeGeminiBackend, FakeGeminiConfig
+from simon.scripts.common import load_tools, percentile
+
+_repo_dir: str = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+parser = argparse.ArgumentParser(description="Benchmark the Gemini pipeline with a fake backend")
+parser.add_argument("-n", type=int, default=20, help="Number of turns per path")
+parser.add_argument("--media", default=os.path.join(_repo_dir, "docs", "assets", "thumbnail.png"), help="Media file for every turn")
+parser.add_argument("--tools", default=os.path.join(_repo_dir, "app-simon-says.py"), help="Python file with a tools section")
+parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that each fake generate call fails")
+parser.add_argument("--seed", type=int, default=0, help="Seed for the fake latency distributions")
+parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+args = parser.parse_args()
+
+logging.basicConfig(format='|%(relativeCreated)d|%(message)s')
+logging.getLogger('gemini').setLevel(logging.DEBUG if args.debug else logging.WARNING)
+log = logging.getLogger('bench')
+log.setLevel(logging.INFO)
+
+async def describe_then_act(gemini: Gemini, tools: Dict[str, Callable]):
+    description = await gemini.async_process_image(args.media)
+    return await gemini.async_use_tool(tools, description)
+
+async def perceive_and_act(gemini: Gemini, tools: Dict[str, Callable]):
+    return await gemini.async_perceive_and_act(tools, args.media, gemini.config.default_image_prompt)
+
+async def main():
+    tools = load_tools(args.tools)
+    for path in (describe_then_act, perceive_and_act):
+        backend = FakeGeminiBackend(FakeGeminiConfig(seed=args.seed, failure_rate={"generate": args.failure_rate}))
+        # fresh client per path so caches from one path do not flatter the other
+        gemini = Gemini(GeminiConfig(name="bench", use_intents=False, use_memo=False, rate_limit_rpm=None), backend=backend)
+        gemini.register_tools(tools)
+        latencies: List[float] = []
+        errors = 0
+        for _ in range(args.n):
+            start = time.time()
+            try:
+                await path(gemini, tools)
+                latencies.append(time.time() - start)
+            except Exception as e:
+                errors += 1
+                log.debug(f"❌ {path.__name__}: {str(e)}")
+        log.info(f"📊 {path.__name__}: p50={percentile(latencies, 0.50):.2f}s p95={percentile(latencies, 0.95):.2f}s "
+                 f"requests={len(backend.requests)} errors={errors} routes={gemini.routes}")
+    await first_action(tools)
+
+async def first_action(tools: Dict[str, Callable]):
+    # a streamed decision must start each tool when its own chunk arrives, not when the next one does
+    chunk_delay = 0.5
+    names = list(tools.keys())[:3]
+    latency = dict(FakeGeminiConfig(name="bench").latency, stream_chunk=(chunk_delay, 0.0))
+    backend = FakeGeminiBackend(FakeGeminiConfig(seed=args.seed, latency=latency, script=[[(name, {}) for name in names]]))
+    gemini = Gemini(GeminiConfig(name="bench", use_intents=False, use_memo=False, rate_limit_rpm=None), backend=backend)
+    results = await gemini.async_use_tool(tools, "first action", stream=True)
+    starts = [result.start for result in results]
+    log.info(f"📊 first_action: starts={', '.join(f'{start:.2f}s' for start in starts)} chunk_delay={chunk_delay:.2f}s")
+    assert starts[0] < chunk_delay / 2, f"first tool started after {starts[0]:.2f}s, it waited for the next chunk"
+    assert all(start < chunk_delay * (i + 0.5) for i, start in enumerate(starts)), f"tools started late: {starts}"
+
+asyncio.run(main())
@@ -0,0 +1,26 @@
+""" Helpers shared by the offline Gemini scripts, importing this module has no side effects. """
+import ast
+import re
+from typing import Callable, Dict, List
+
+def stand_in_tool(name: str, doc: str = None) -> Callable:
+    def tool() -> str:
+        return name
+    tool.__name__ = name
+    tool.__doc__ = doc
+    return tool
+
+def load_tools(file_path: str) -> Dict[str, Callable]:
+    # stand-in tools with the same names and docstrings, they only report which tool was chosen
+    with open(file_path) as f:
+        content = f.read()
+    match = re.search(r'# ---- TOOLS 🛠️ ----\s*([\s\S]*?)# ---- TOOLS 🛠️ ----', content)
+    tools: Dict[str, Callable] = {}
+    for node in ast.parse(match.group(1) if match else content).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            tools[node.name] = stand_in_tool(node.name, ast.get_docstring(node))
+    return tools
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0